@@ -0,0 +1,219 @@
+import sys
+import array
+import collections
+
+INF = float('inf')
+CACHE_BYTES = 32 * 1024 * 1024  # 分配缓存占用内存的上限
+SLOT_BYTES = 104  # OrderedDict里每一项自己的开销
+
+
+class Assignment(object):
+    """
+      An optimal box -> destination assignment, with the potentials of the
+      hungarian algorithm kept so one changed row can be repaired in O(n²).
+      rows[i] is the cell of the box on row i+1 (the arrays are 1-indexed).
+      With more boxes than destinations every destination gets its own box
+      and the other boxes are free; such an entry is not repaired, so u, v
+      and p are None.
+    """
+    __slots__ = ('cost', 'rows', 'u', 'v', 'p', 'loose')
+
+    def __init__(self, cost, rows, u, v, p, loose):
+        self.cost = cost
+        self.rows = rows
+        self.u = u
+        self.v = v
+        self.p = p  # 目的地列 -> 箱子行
+        self.loose = loose  # 不在目的地上的箱子位置
+
+
+class AssignmentHeuristic(object):
+    """
+      Minimum cost matching of the boxes not on a destination to the
+      destinations, by the hungarian algorithm.
+
+      A box already on a destination gets a row that only reaches its own
+      destination, so every push changes exactly one row and the parent's
+      assignment is repaired with one phase of the hungarian algorithm
+      instead of a fresh O(n³) solve. Results are kept in an LRU cache keyed
+      by the box bitmask and bounded to maxbytes, so states that differ only
+      by the man's position pay nothing.
+
+      With pinned False a box on a destination keeps its full row, which
+      gives the plain minimum matching.
+    """
+
+    def __init__(self, board, distance_func, unreachable, maxbytes=CACHE_BYTES, pinned=True):
+        self.board = board
+        self.pinned = pinned
+        self.distance_func = distance_func
+        self.unreachable = unreachable
+        self.maxbytes = maxbytes
+        self.cache = collections.OrderedDict()
+        self.nbytes = 0  # 缓存里的分配大约占的字节数
+        self.cell_rows = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.repairs = 0  # misses fixed up from the parent's assignment
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'repairs': self.repairs, 'size': len(self.cache),
+                'bytes': self.nbytes}
+
+    def clear(self):
+        self.cache.clear()
+        self.nbytes = 0
+
+    def lookup(self, state, parent=None):
+        """The assignment for state's boxes. parent is the state being expanded, if known."""
+        boxes = state.boxes
+        entry = self.cache.get(boxes)
+        if entry is not None:
+            self.hits += 1
+            self.cache.move_to_end(boxes)
+            return entry
+
+        self.misses += 1
+        entry = None
+        if parent is not None:
+            moved = parent.boxes ^ boxes
+            from_mask = moved & parent.boxes
+            to_mask = moved & boxes
+            # 只推了一个箱子
+            if from_mask and to_mask and from_mask & (from_mask - 1) == 0 and to_mask & (to_mask - 1) == 0:
+                parent_entry = self.cache.get(parent.boxes)
+                if parent_entry is not None and parent_entry.p is not None:
+                    entry = self._repair(parent_entry, from_mask.bit_length() - 1, to_mask.bit_length() - 1, boxes)
+                    self.repairs += 1
+
+        if entry is None:
+            entry = self._solve(boxes)
+
+        self.cache[boxes] = entry
+        self.nbytes += self._nbytes(boxes, entry)
+        while self.nbytes > self.maxbytes and len(self.cache) > 1:
+            old_boxes, old = self.cache.popitem(last=False)
+            self.nbytes -= self._nbytes(old_boxes, old)
+        return entry
+
+    @staticmethod
+    def _nbytes(boxes, entry):
+        n = SLOT_BYTES + sys.getsizeof(boxes) + sys.getsizeof(entry) + sys.getsizeof(entry.rows) + \
+            sys.getsizeof(entry.loose)
+        if entry.p is not None:
+            n += sys.getsizeof(entry.u) + sys.getsizeof(entry.v) + sys.getsizeof(entry.p)
+        return n
+
+    def _row(self, cell):
+        row = self.cell_rows.get(cell)
+        if row is None:
+            bd = self.board
+            if self.pinned and (bd.dest_mask >> cell) & 1:
+                row = [0 if dest == cell else self.unreachable for dest in bd.dest_cells]
+            else:
+                pos = bd.cell_to_pos[cell]
+                row = [self.distance_func(pos, bd.cell_to_pos[dest]) for dest in bd.dest_cells]
+            row.insert(0, 0)  # 1-indexed
+            self.cell_rows[cell] = row
+        return row
+
+    def _loose(self, boxes):
+        bd = self.board
+        return tuple([bd.cell_to_pos[c] for c in bd.cells_of(boxes & ~bd.dest_mask)])
+
+    def _solve(self, boxes):
+        rows = self.board.cells_of(boxes)
+        n = len(rows)
+        m = len(self.board.dest_cells)
+        if n > m:
+            return self._solve_extra(boxes, rows)
+        u = [0] * (n + 1)
+        v = [0] * (m + 1)
+        p = [0] * (m + 1)
+        a = [None] + [self._row(c) for c in rows]
+        for i in range(1, n + 1):
+            self._augment(a, i, u, v, p)
+        return self._entry(a, rows, u, v, p, boxes)
+
+    def _solve_extra(self, boxes, rows):
+        # 箱子比目的地多时每个目的地配一个不同的箱子就行，多的箱子随便放。_augment要求行不比列多，
+        # 所以转置过来，目的地做行、箱子做列。这种分配不增量修正，每次重算
+        n = len(rows)
+        m = len(self.board.dest_cells)
+        box_rows = [self._row(c) for c in rows]
+        a = [None] + [[0] + [box_rows[i][j] for i in range(n)] for j in range(1, m + 1)]
+        u = [0] * (m + 1)
+        v = [0] * (n + 1)
+        p = [0] * (n + 1)
+        for i in range(1, m + 1):
+            self._augment(a, i, u, v, p)
+        cost = 0
+        for j in range(1, n + 1):
+            if p[j]:
+                cost += a[p[j]][j]
+        return Assignment(cost, tuple(rows), None, None, None, self._loose(boxes))
+
+    def _repair(self, parent_entry, from_cell, to_cell, boxes):
+        rows = list(parent_entry.rows)
+        i = rows.index(from_cell) + 1
+        rows[i - 1] = to_cell
+        u = parent_entry.u.tolist()
+        v = parent_entry.v.tolist()
+        p = parent_entry.p.tolist()
+        for j in range(1, len(p)):
+            if p[j] == i:
+                p[j] = 0
+                break
+        a = [None] + [self._row(c) for c in rows]
+        # 其余行的势仍然可行且匹配边是紧的，只需要为第i行再找一次增广路
+        self._augment(a, i, u, v, p)
+        return self._entry(a, rows, u, v, p, boxes)
+
+    def _entry(self, a, rows, u, v, p, boxes):
+        cost = 0
+        for j in range(1, len(p)):
+            if p[j]:
+                cost += a[p[j]][j]
+        # 缓存里存成array，比一堆int对象的list小得多
+        return Assignment(cost, tuple(rows), array.array('q', u), array.array('q', v), array.array('q', p),
+                          self._loose(boxes))
+
+    @staticmethod
+    def _augment(a, i, u, v, p):
+        # 匈牙利算法的一个阶段: 把第i行加入匹配，同时维护势u, v
+        m = len(p) - 1
+        p[0] = i
+        j0 = 0
+        minv = [INF] * (m + 1)
+        used = [False] * (m + 1)
+        way = [0] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = a[i0]
+            ui0 = u[i0]
+            delta = INF
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
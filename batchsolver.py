@@ -1,55 +1,72 @@
+import multiprocessing
+
 import space
+import levels
 import solver
+import scheduler
+import tablestore
+import telemetry
+
+# worker里用的全局变量，关卡的索引在fork之前建好，worker直接继承，不用pickle
+_levels = None
+_counters = None  # telemetry.Telemetry，每个worker一个slot
+_slot = None
+_store = None
+
+
+def _load_levels():
+    global _levels
+    if _levels is None:
+        _levels = levels.LevelCollection()
+    return _levels
 
 
-def _solve(lvl, problem, queue):
-    queue.put([0, lvl])
+def _init(counters, next_slot):
+    global _counters, _slot, _store
+    with next_slot.get_lock():
+        _slot = next_slot.value % counters.slots
+        next_slot.value += 1
+    _counters = counters
+    _store = tablestore.TableStore()
+
+
+def _solve(lvl):
+    # 只收到关卡号，关卡只读这一关，problem和deadlock表都在worker里准备
+    problem = solver.SokobanSearchProblem(_load_levels().load(lvl), store=_store)
+    problem.progress = _counters.reporter(_slot, problem)
     actions, exploredSet = problem.solve()
-    queue.put([1, (lvl, actions, len(exploredSet))])
+    problem.progress.finish(len(exploredSet))
+    if problem.pruner:
+        print("lvl={0} pruned: {1}".format(lvl, problem.pruner.report()))
+    return lvl, actions, len(exploredSet)
 
 
 def main():
-    from multiprocessing import Pool, Manager
-    m = Manager()
-    queue = m.Queue()
-
-    thinking = set()
+    ncpu = multiprocessing.cpu_count()
+    counters = telemetry.Telemetry(ncpu)
     settings = space.SokobanSettings()
 
-    layouts = space.SokobanLoader().load_maps()
-    problems = [(lvl, solver.SokobanSearchProblem(startState), queue)
-                for lvl, startState in enumerate(layouts) if lvl not in settings.solved]
-    import random
-    random.shuffle(problems)
-    print("共{0}关卡，剩余{1}未解决".format(len(layouts), len(problems)))
-
-    with Pool() as p:
-        q = m.Queue()
-        r = p.starmap_async(_solve, problems)
-        while not r.ready():
-            try:
-                info_type, info = queue.get(timeout=0.1)
-                if info_type == 0:
-                    lvl = info
-                    thinking.add(lvl)
-
-                elif info_type == 1:
-                    lvl, actions, explored = info
-                    action_str = "".join(actions)
-                    thinking.remove(lvl)
-                    settings.solved[lvl] = (action_str, explored)
-                    print("lvl={0} think={1} solved={2}, wait={3}: res={4}, {5}".format(
-                        lvl,
-                        len(thinking),
-                        len(settings.solved),
-                        len(layouts) - len(thinking) - len(settings.solved),
-                        explored,
-                        action_str
-                    ))
-
-                    settings.set_solved(settings.solved)
-            except:
-                pass
+    layouts = _load_levels()
+    # 估计的难度从易到难，先把容易的解掉
+    # 同一个开始局面在别的关卡号下解过的，直接记下来
+    states = list(enumerate(layouts))
+    pending = set(settings.solved.adopt([(lvl, startState.layout) for lvl, startState in states]))
+    unsolved = scheduler.rank([(lvl, startState) for lvl, startState in states if lvl in pending])
+    print("共{0}关卡，剩余{1}未解决".format(len(layouts), len(unsolved)))
+
+    with multiprocessing.Pool(ncpu, initializer=_init, initargs=(counters, multiprocessing.Value('i', 0))) as p:
+        for lvl, actions, explored in p.imap_unordered(_solve, [lvl for lvl, _ in unsolved]):
+            action_str = "".join(actions)
+            thinking = len([s for s in counters.samples() if s.active])
+            settings.solved.add(lvl, action_str, explored, layouts.load(lvl).layout)
+            print("lvl={0} think={1} solved={2}, wait={3}: res={4}, {5}".format(
+                lvl,
+                thinking,
+                len(settings.solved),
+                len(layouts) - thinking - len(settings.solved),
+                explored,
+                action_str
+            ))
 
 
 if __name__ == '__main__':
@@ -1,19 +1,54 @@
+import os
+import sys
 import time
+import queue
+import signal
+import argparse
 import multiprocessing
 
+try:
+    import resource
+except ImportError:  # windows没有resource，不能限制内存
+    resource = None
+
 import space
+import levels
+import search
 import solver
+import portfolio
+import scheduler
+import tablestore
+import telemetry
+
+
+STATUS_INTERVAL = 10  # 每隔多少秒打印一次正在解的关卡的进度
+SAVE_GRACE = 60  # 超时后等多少秒让它存完盘，之后直接kill
 
 
 class TimeoutThinker:
-    def __init__(self, level, startState, queue):
-        self.level = level
-        self.startState = startState
-        self.queue = queue
-        self.problem = solver.SokobanSearchProblem(startState, self._progress)
+    def __init__(self, job, queue, counters, slot, portfolio_size=None, checkpoint_dir=None, checkpoint_interval=300,
+                 **problem_args):
+        self.job = job  # scheduler.Job，带着这一轮的超时和内存上限
+        self.level = job.level
+        self.startState = job.startState
+        self.queue = queue  # 只发结果，进度写在counters的slot里
+        self.counters = counters  # telemetry.Telemetry
+        self.slot = slot
+        counters.clear(slot)
+        self.portfolio_size = portfolio_size
+        self.checkpoint_dir = checkpoint_dir  # A*的存盘目录，None不存
+        self.checkpoint_interval = checkpoint_interval
+        if problem_args.get('algorithm') == portfolio.PORTFOLIO:
+            self.problem = None  # 在子进程里赛跑
+        else:
+            self.problem = solver.SokobanSearchProblem(self.startState, store=tablestore.TableStore(),
+                                                       **problem_args)
+        self.reporter = counters.reporter(slot, self.problem)
+        if self.problem is not None:
+            self.problem.progress = self.reporter
         self.process = multiprocessing.Process(target=self._solve)
         self.startTime = time.time()
-        self.exploredSize = 0
+        self.stopTime = None  # 超时后发了SIGTERM的时间
 
     def start(self):
         self.process.start()
@@ -21,101 +56,225 @@ class TimeoutThinker:
     def end(self):
         self.process.terminate()
 
-    def _progress(self, exploredSet, frontier):
-        exploredSize, frontierSize = len(exploredSet), len(frontier)
-        if exploredSize % 100 == 0:
-            self.queue.put([0, (self.level, exploredSize, frontierSize)])
-
     def _solve(self):
-        actions, exploredSet = self.problem.solve()
+        # 超时被terminate时抛SystemExit，finally里结束portfolio和并行A*的子进程
+        signal.signal(signal.SIGTERM, _exit_on_terminate)
+        if self.job.memory and resource is not None:
+            resource.setrlimit(resource.RLIMIT_AS, (self.job.memory, self.job.memory))
+        if self.problem is not None and self.checkpoint_dir and self.problem.algorithm in solver.CHECKPOINTED:
+            # 超时时先存盘再退出，下一轮从存盘处继续；换了算法、权重或者剪枝就是另一个文件
+            tag = self.problem.checkpoint_tag()
+            path = os.path.join(self.checkpoint_dir, 'level_{0}_{1}.ckpt'.format(self.level, tag))
+            if os.path.exists(path):
+                print("lvl={0} resume from {1}".format(self.level, path))
+            self.problem.checkpoint = search.Checkpointer(path, self.checkpoint_interval, signal.SIGTERM, tag)
+        try:
+            if self.problem is None:
+                return self._solve_portfolio()
+            actions, exploredSet = self.problem.solve()
+        except MemoryError:
+            actions = None
+        if actions is None:
+            # except结束后搜索占的内存才释放，这时才发得出消息
+            self.problem = None
+            self.queue.put([2, (self.level, scheduler.MEMORY, self.reporter.expanded)])
+            return
         exploredSize = len(exploredSet)
-        self.queue.put([1, (self.level, actions, exploredSize)])
+        if self.problem.pruner:
+            print("lvl={0} pruned: {1}".format(self.level, self.problem.pruner.report()))
+        self._put_result(actions, exploredSize)
+
+    def _put_result(self, actions, exploredSize):
+        self.reporter.finish(exploredSize)
+        if actions:
+            self.queue.put([1, (self.level, actions, exploredSize)])
+        else:
+            self.queue.put([2, (self.level, scheduler.FAILED, exploredSize)])
+
+    def _solve_portfolio(self):
+        racer = portfolio.PortfolioSolver(self.startState, size=self.portfolio_size,
+                                          log=lambda text: print("lvl={0} {1}".format(self.level, text)))
+        racer.start()
+        try:
+            while True:
+                info = racer.poll()
+                if info is None:
+                    time.sleep(0.05)
+                    continue
+                info_type, info = info
+                if info_type == 0:
+                    exploredSize, frontierSize = info
+                    self.reporter.publish(exploredSize, frontierSize)
+                else:
+                    actions, exploredSize = info
+                    self._put_result(actions, exploredSize)
+                    return
+        finally:
+            racer.end()
+
+
+def _exit_on_terminate(signum, frame):
+    sys.exit(0)
 
 
 class ThinkerManager:
-    def __init__(self, ncpu=0, timeout=20):
+    def __init__(self, ncpu=0, timeout=30, timeout_factor=2.0, memory=0, memory_factor=2.0, max_rounds=4,
+                 **problem_args):
 
-        self.timeout = timeout
+        self.problem_args = problem_args  # 传给solver.SokobanSearchProblem
         if ncpu == 0:
             ncpu = multiprocessing.cpu_count()
 
         self.ncpu = ncpu
         m = multiprocessing.Manager()
 
-        self.queue = m.Queue()
+        self.queue = m.Queue()  # 只有结果，进度从counters里读
+        self.counters = telemetry.Telemetry(ncpu)
+        self.free_slots = list(range(ncpu))
         self.settings = space.SokobanSettings()
-        self.layouts = space.SokobanLoader().load_maps()
+        self.layouts = levels.LevelCollection()
 
-        self.problems = [(level, startState)
-                         for level, startState in enumerate(self.layouts) if level not in self.settings.solved]
+        # 同一个开始局面在别的关卡号下解过的，直接记下来
+        states = list(enumerate(self.layouts))
+        pending = set(self.settings.solved.adopt([(level, startState.layout) for level, startState in states]))
+        problems = [(level, startState) for level, startState in states if level in pending]
+        self.scheduler = scheduler.Scheduler(problems, timeout, timeout_factor, memory, memory_factor, max_rounds)
 
         self.thinking = {}
-        self.problem_idx = 0
+        self.statusTime = time.time()
 
     def start(self):
 
-        print("共{0}关卡，剩余{1}未解决，开启{2}个进程开始解决, 超时时间={3}".format(
-            len(self.layouts), len(self.problems), self.ncpu, self.timeout))
+        print("共{0}关卡，剩余{1}未解决，其中{2}已经放弃，开启{3}个进程开始解决, 第一轮超时时间={4}".format(
+            len(self.layouts), len(self.scheduler) + self.scheduler.dropped, self.scheduler.dropped, self.ncpu,
+            self.scheduler.timeout))
         self._try_start_new_thinker()
 
         while True:
-            if len(self.thinking) == 0 and self.problem_idx == len(self.problems):
+            if len(self.thinking) == 0 and len(self.scheduler) == 0:
                 return
             self._end_timeout_thinker()
             self._try_start_new_thinker()
+            self._print_status()
+            self._drain(timeout=0.1)
+
+    def _drain(self, timeout=0):
+        """Handle the results in the queue, waiting up to timeout seconds for the first one."""
+        while True:
             try:
-                info_type, info = self.queue.get(timeout=0.1)
-                if info_type == 0:
-                    level, exploredSize, _ = info
-                    if level in self.thinking:
-                        self.thinking[level].exploredSize = exploredSize
-
-                elif info_type == 1:
-                    level, actions, explored = info
-                    action_str = "".join(actions)
-                    if level in self.thinking:
-                        del self.thinking[level]
-
-                    self.settings.solved[level] = (action_str, explored)
-                    print("lvl={0} think={1} solved={2}, wait={3}: res={4}, {5}".format(
-                        level,
-                        len(self.thinking),
-                        len(self.settings.solved),
-                        len(self.layouts) - len(self.thinking) - len(self.settings.solved),
-                        explored,
-                        action_str
-                    ))
-
-                    self.settings.set_solved(self.settings.solved)
-            except:
-                pass
+                if timeout:
+                    info_type, info = self.queue.get(timeout=timeout)
+                    timeout = 0
+                else:
+                    info_type, info = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if info_type == 1:
+                level, actions, explored = info
+                action_str = "".join(actions)
+                if level in self.thinking:
+                    thinker = self.thinking.pop(level)
+                    self.free_slots.append(thinker.slot)
+                    self.scheduler.done(thinker.job, scheduler.SOLVED, explored)
+
+                self.settings.solved.add(level, action_str, explored, self.layouts[level].layout)
+                print("lvl={0} think={1} solved={2}, wait={3}: res={4}, {5}".format(
+                    level,
+                    len(self.thinking),
+                    len(self.settings.solved),
+                    len(self.scheduler),
+                    explored,
+                    action_str
+                ))
+
+            elif info_type == 2:
+                level, result, explored = info
+                if level in self.thinking:
+                    thinker = self.thinking.pop(level)
+                    self._fail(thinker, result, explored or self.counters.read(thinker.slot).expanded)
+
+    def _print_status(self):
+        if time.time() - self.statusTime < STATUS_INTERVAL:
+            return
+        self.statusTime = time.time()
+        for level, thinker in sorted(self.thinking.items()):
+            s = self.counters.read(thinker.slot)
+            print("lvl={0} expanded={1} generated={2} pruned={3} frontier={4} rss={5}MB {6:.0f}/s {7:.0f}s".format(
+                level, s.expanded, s.generated, s.pruned, s.frontier, s.rss // (1024 * 1024), s.rate, s.elapsed))
 
     def _try_start_new_thinker(self):
         while len(self.thinking) < self.ncpu:
-            if self.problem_idx < len(self.problems):
-                level, startState = self.problems[self.problem_idx]
-                self.problem_idx += 1
-                thinker = TimeoutThinker(level, startState, self.queue)
-                self.thinking[level] = thinker
-                thinker.start()
-            else:
+            job = self.scheduler.next()
+            if job is None:
                 return
+            thinker = TimeoutThinker(job, self.queue, self.counters, self.free_slots.pop(), **self.problem_args)
+            self.thinking[job.level] = thinker
+            thinker.start()
+
+    def _fail(self, thinker, result, explored):
+        self.free_slots.append(thinker.slot)
+        job = thinker.job
+        print("lvl={0} round={1} {2} after {3:.0f}s explored={4}".format(
+            job.level, job.round, result, time.time() - thinker.startTime, explored))
+        self.scheduler.done(job, result, explored)
 
     def _end_timeout_thinker(self):
-        timeout = []
+        exited = []
         curTime = time.time()
         for level, thinker in self.thinking.items():
-            if curTime - thinker.startTime > 30:
-                timeout.append(level)
-                thinker.end()
-                print("lvl={0} timeout explored={1}".format(level, thinker.exploredSize))
+            if not thinker.process.is_alive():
+                exited.append(level)
+            elif thinker.stopTime is None:
+                if curTime - thinker.startTime > thinker.job.timeout:
+                    thinker.end()  # 它存完盘自己退出，不在这里等
+                    thinker.stopTime = curTime
+            elif curTime - thinker.stopTime > SAVE_GRACE:
+                thinker.process.kill()
+        if not exited:
+            return
+
+        # Manager的队列put返回时消息已经到了，进程退出前发的结果这时都能读到
+        self._drain()
+        for level in exited:
+            thinker = self.thinking.pop(level, None)
+            if thinker is None:
+                continue  # 结果已经处理了
+            thinker.process.join()
+            if thinker.stopTime is not None:
+                result = scheduler.TIMEOUT
+            elif thinker.process.exitcode and thinker.job.memory:
+                result = scheduler.MEMORY  # 没报结果就异常退出，多半是超了内存上限
+            else:
+                result = scheduler.FAILED
+            self._fail(thinker, result, self.counters.read(thinker.slot).expanded)
 
-        for level in timeout:
-            del self.thinking[level]
+
+ALGORITHMS = dict(solver.ALGORITHMS, portfolio=portfolio.PORTFOLIO)  # portfolio在solver之上，不能放进solver
 
 
 def main():
-    man = ThinkerManager(ncpu=0, timeout=180)
+    parser = argparse.ArgumentParser(description="解决所有还没解决的关卡")
+    parser.add_argument('--ncpu', type=int, default=0, help="进程数，0为cpu个数")
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='astar_deadlock')
+    parser.add_argument('--spill-dir', default=None, help="external_astar的临时文件目录")
+    parser.add_argument('--ram-budget', type=int, default=256, help="external_astar每个进程缓存多少MB再写盘")
+    parser.add_argument('--portfolio-size', type=int, default=2, help="portfolio每关同时跑几个配置")
+    parser.add_argument('--workers', type=int, default=None, help="parallel_astar每关的进程数，默认cpu个数")
+    parser.add_argument('--timeout', type=float, default=30, help="第一轮每关的超时秒数")
+    parser.add_argument('--timeout-factor', type=float, default=2.0, help="每多一轮超时时间乘上这个数")
+    parser.add_argument('--memory', type=int, default=0, help="第一轮每关的内存上限MB，0不限")
+    parser.add_argument('--memory-factor', type=float, default=2.0, help="每多一轮内存上限乘上这个数")
+    parser.add_argument('--rounds', type=int, default=4, help="每关最多试几轮")
+    parser.add_argument('--checkpoint-dir', default='checkpoints', help="A*超时时的存盘目录，空字符串不存盘")
+    parser.add_argument('--checkpoint-interval', type=float, default=300, help="A*每隔多少秒存一次盘")
+    args = parser.parse_args()
+
+    man = ThinkerManager(ncpu=args.ncpu, timeout=args.timeout, timeout_factor=args.timeout_factor,
+                         memory=args.memory * 1024 * 1024, memory_factor=args.memory_factor, max_rounds=args.rounds,
+                         algorithm=ALGORITHMS[args.algorithm],
+                         spill_dir=args.spill_dir, ram_budget=args.ram_budget * 1024 * 1024,
+                         portfolio_size=args.portfolio_size, workers=args.workers,
+                         checkpoint_dir=args.checkpoint_dir, checkpoint_interval=args.checkpoint_interval)
     man.start()
 
 
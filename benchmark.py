@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # windows没有resource，不能限制和统计内存
+    resource = None
+
+import levels
+import solver
+import portfolio
+import scheduler
+import tablestore
+
+DEFAULT_LEVELS = '0-19'
+DEFAULT_ALGORITHMS = 'astar_deadlock,astar_push'
+DEFAULT_OUTPUT = 'benchmark.json'
+TOLERANCE = 0.10  # 比基线差多少算退步
+MIN_SECONDS = 0.05  # 时间差小于这个数不算，太短的关卡只有噪声
+MIN_RSS = 8 * 1024 * 1024
+
+
+def parse_levels(text):
+    """'0-9,15,20-22' -> [0, 1, ..., 9, 15, 20, 21, 22]"""
+    levels = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            levels.extend(range(int(first), int(last) + 1))
+        else:
+            levels.append(int(part))
+    return levels
+
+
+def peak_rss():
+    """Peak RSS in bytes of this process and of its finished children, 0 if unknown."""
+    if resource is None:
+        return 0
+    scale = 1 if sys.platform == 'darwin' else 1024  # linux上ru_maxrss的单位是KB
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+def _run(startState, algorithm, memory, use_store, conn):
+    if memory and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    result = {}
+    try:
+        t = time.perf_counter()
+        problem = solver.SokobanSearchProblem(startState, algorithm=algorithm,
+                                              store=tablestore.TableStore() if use_store else None)
+        result['prep'] = time.perf_counter() - t
+        t = time.perf_counter()
+        actions, exploredSet = problem.solve()
+        result['seconds'] = time.perf_counter() - t
+        result['expanded'] = len(exploredSet)
+        result['length'] = len(actions)
+        solved = bool(actions) and portfolio.is_solution(startState, actions)
+        result['status'] = scheduler.SOLVED if solved else scheduler.FAILED
+    except MemoryError:
+        result = {'status': scheduler.MEMORY}
+    result['rss'] = peak_rss()
+    conn.send(result)
+
+
+def run_one(startState, algorithm, timeout, memory, use_store):
+    """
+      Solve one level in a forked process, killed after timeout seconds and
+      limited to memory bytes of address space (0 for no limit). Returns a
+      dict with status and, when the search finished, prep and seconds,
+      expanded, length and rss.
+    """
+    ctx = multiprocessing.get_context('fork')
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run, args=(startState, algorithm, memory, use_store, child))
+    start = time.perf_counter()
+    process.start()
+    child.close()
+    try:
+        if parent.poll(timeout or None):
+            return parent.recv()
+        if process.is_alive():
+            return {'status': scheduler.TIMEOUT, 'seconds': time.perf_counter() - start}
+        # 没发结果就退出了，多半是超了内存上限
+        return {'status': scheduler.MEMORY if memory else scheduler.FAILED}
+    except EOFError:
+        return {'status': scheduler.MEMORY if memory else scheduler.FAILED}
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def best_of(results):
+    """Several runs of the same level: the fastest solved run, or the first if none solved."""
+    solved = [r for r in results if r['status'] == scheduler.SOLVED]
+    if not solved:
+        return results[0]
+    return min(solved, key=lambda r: r['seconds'])
+
+
+def run_benchmark(layouts, levels, algorithms, timeout=60, memory=0, repeat=1, use_store=False, log=print):
+    results = []
+    for name in algorithms:
+        for level in levels:
+            algorithm = solver.ALGORITHMS[name]
+            runs = [run_one(layouts[level], algorithm, timeout, memory, use_store) for _ in range(repeat)]
+            result = dict(level=level, algorithm=name, **best_of(runs))
+            results.append(result)
+            log(format_result(result))
+    return results
+
+
+def format_result(r):
+    text = "lvl={0} {1} {2}".format(r['level'], r['algorithm'], r['status'])
+    if 'expanded' in r:
+        text += " len={0} expanded={1} prep={2:.2f}s solve={3:.2f}s rss={4}MB".format(
+            r['length'], r['expanded'], r['prep'], r['seconds'], r['rss'] // (1024 * 1024))
+    return text
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+      Regressions of results against the results of a baseline report, as
+      text lines: levels no longer solved, longer solutions, and more time,
+      expansions or memory than the baseline by more than tolerance.
+    """
+    old = {(r['level'], r['algorithm']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = old.get((r['level'], r['algorithm']))
+        if b is None or b['status'] != scheduler.SOLVED:
+            continue
+        key = "lvl={0} {1}".format(r['level'], r['algorithm'])
+        if r['status'] != scheduler.SOLVED:
+            regressions.append("{0}: {1}, was solved".format(key, r['status']))
+            continue
+        if r['length'] > b['length']:
+            regressions.append("{0}: length {1} -> {2}".format(key, b['length'], r['length']))
+        for field, floor in (('seconds', MIN_SECONDS), ('prep', MIN_SECONDS), ('expanded', 0), ('rss', MIN_RSS)):
+            if r[field] > b[field] * (1 + tolerance) and r[field] - b[field] > floor:
+                regressions.append("{0}: {1} {2:g} -> {3:g} ({4:+.0%})".format(
+                    key, field, b[field], r[field], r[field] / b[field] - 1 if b[field] else 1))
+    return regressions
+
+
+def summary(results):
+    """Totals per algorithm over its solved levels."""
+    totals = {}
+    for r in results:
+        t = totals.setdefault(r['algorithm'], {'levels': 0, 'solved': 0, 'seconds': 0.0, 'prep': 0.0,
+                                                'expanded': 0, 'peak_rss': 0})
+        t['levels'] += 1
+        if r['status'] == scheduler.SOLVED:
+            t['solved'] += 1
+            t['seconds'] += r['seconds']
+            t['prep'] += r['prep']
+            t['expanded'] += r['expanded']
+            t['peak_rss'] = max(t['peak_rss'], r['rss'])
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对一部分关卡跑各个算法，记录时间、展开数和内存，和基线比较")
+    parser.add_argument('--maps', default=levels.DEFAULT_PATH, help="关卡文件，res/map.txt的格式或者XSB/.sok")
+    parser.add_argument('--levels', default=DEFAULT_LEVELS, help="关卡，比如 0-9,15,20-22")
+    parser.add_argument('--algorithms', default=DEFAULT_ALGORITHMS,
+                        help="逗号分隔，可选: {0}".format(",".join(sorted(solver.ALGORITHMS))))
+    parser.add_argument('--timeout', type=float, default=60, help="每关的超时秒数，0不限")
+    parser.add_argument('--memory', type=int, default=0, help="每关的内存上限MB，0不限")
+    parser.add_argument('--repeat', type=int, default=1, help="每关跑几次，取最快的一次")
+    parser.add_argument('--tables', action='store_true', help="用tablestore里存好的表，准备时间不算计算表")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="结果写到这个JSON文件")
+    parser.add_argument('--baseline', default=None, help="和这个JSON文件里的结果比较")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="比基线差多少算退步，0.1即10%%")
+    args = parser.parse_args()
+
+    algorithms = [a.strip() for a in args.algorithms.split(',') if a.strip()]
+    for name in algorithms:
+        if name not in solver.ALGORITHMS:
+            parser.error("unknown algorithm {0}".format(name))
+    layouts = levels.LevelCollection(args.maps)
+    chosen = parse_levels(args.levels)
+    for level in chosen:
+        if not 0 <= level < len(layouts):
+            parser.error("no level {0}, there are {1}".format(level, len(layouts)))
+
+    print("{0}个关卡 x {1}个算法，超时{2}秒".format(len(chosen), len(algorithms), args.timeout))
+    start = time.time()
+    results = run_benchmark(layouts, chosen, algorithms, args.timeout, args.memory * 1024 * 1024, args.repeat,
+                            args.tables)
+    totals = summary(results)
+    for name in algorithms:
+        t = totals[name]
+        print("{0}: solved {1}/{2} solve={3:.2f}s prep={4:.2f}s expanded={5} peak rss={6}MB".format(
+            name, t['solved'], t['levels'], t['seconds'], t['prep'], t['expanded'], t['peak_rss'] // (1024 * 1024)))
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'seconds': time.time() - start,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': multiprocessing.cpu_count(),
+        'maps': args.maps,
+        'timeout': args.timeout,
+        'memory': args.memory,
+        'repeat': args.repeat,
+        'tables': args.tables,
+        'summary': totals,
+        'results': results,
+    }
+    tmp = args.output + '.tmp{0}'.format(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    os.replace(tmp, args.output)
+    print("结果写到了{0}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        print("和{0}比较: {1}处退步".format(args.baseline, len(regressions)))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import math
+import itertools
+
+import util
+import search
+import assignment
+import deadlock
+
+MAX_GOAL_SETS = 1000  # 箱子比目的地多时，多的箱子放法超过这么多就不从目标反向搜了
+
+
+class Side(object):
+    """
+      One direction of the search: a best first frontier ordered by g + h
+      and, for every state generated, the push that links it to the state
+      it came from.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.frontier = util.PriorityQueue()
+        self.links = {}  # 状态 -> (来的那个状态, 推箱子的动作)
+        self.g = {}
+        self.closed = set()
+
+    def add(self, state, link, g, h):
+        self.links[state] = link
+        self.g[state] = g
+        self.frontier.push(state, g + h)
+
+    def pop(self):
+        # 同一个状态可能进了frontier多次，展开过的跳过
+        while not self.frontier.isEmpty():
+            state = self.frontier.pop()
+            if state not in self.closed:
+                self.closed.add(state)
+                return state
+        return None
+
+
+class BidirectionalSearch(object):
+    """
+      Push level search from both ends. The forward side pushes from the
+      start state like solver.ASTAR_PUSH. The backward side starts with all
+      boxes on destinations, one state per region the man can be in, and
+      pulls boxes away (see board.SokobanBoard.pulls). Both sides keep
+      normalized states, so a state is one box configuration plus a man
+      region. The two link tables are the shared hash table the sides meet
+      in.
+
+      The backward side is guided by the assignment of its boxes to the
+      start box cells, using the deadlock.Deadlock distance table read
+      backwards. A pull after which the boxes cannot be matched to start
+      box cells they are pushable from is dropped. The side with the smaller frontier is expanded
+      next. The search stops at the first meeting, so the solution is not
+      always the shortest.
+
+      With more boxes than destinations the goal is any box set that covers
+      the destinations, so the backward side starts from every placement of
+      the extra boxes, up to MAX_GOAL_SETS of them. Beyond that it starts
+      empty and the forward side, which also stops at a goal state of its
+      own, does the whole search. With fewer boxes than destinations there
+      is nothing to search.
+    """
+
+    def __init__(self, problem, heuristic, progress=search.nullProgress):
+        self.problem = problem
+        self.heuristic = heuristic
+        self.progress = progress or search.nullProgress
+        self.board = problem.board
+        self.explored = search.ExploredCounter()
+
+        start = problem.getStartState()
+        # 反向搜索的"目的地"是开始时箱子的位置
+        self.start_board = self.board.with_dests(start.boxes)
+        dl = problem.deadlock
+        self.start_assignment = assignment.AssignmentHeuristic(
+            self.start_board, lambda pos, start_pos: dl.get_distance(start_pos, pos), deadlock.UNREACHABLE,
+            pinned=False)
+
+        self.forward = Side('forward')
+        self.backward = Side('backward')
+        self.forward.add(start, None, 0, heuristic(start, problem))
+        self.box_cnt = bin(start.boxes).count('1')
+        for goal in self.goal_states():
+            h = self._backward_h(goal, None)
+            if h < deadlock.UNREACHABLE:
+                self.backward.add(goal, None, 0, h)
+
+    def goal_states(self):
+        bd = self.board
+        extra = self.box_cnt - len(bd.dest_cells)
+        if extra < 0:
+            return []
+        others = [c for c in range(bd.cell_cnt) if not (bd.dest_mask >> c) & 1]
+        if math.comb(len(others), extra) > MAX_GOAL_SETS:
+            return []
+        goals = []
+        for cells in itertools.combinations(others, extra):
+            boxes = bd.dest_mask
+            for c in cells:
+                boxes |= 1 << c
+            goals.extend(self._regions(boxes))
+        return goals
+
+    def _regions(self, boxes):
+        # 箱子不动时人能待的每块区域一个状态
+        bd = self.board
+        seen = bytearray(bd.cell_cnt)
+        states = []
+        for c in range(bd.cell_cnt):
+            if seen[c] or (boxes >> c) & 1:
+                continue
+            cells, _ = bd.reach(boxes, c)
+            for r in cells:
+                seen[r] = 1
+            states.append(bd.normalize(boxes, c))
+        return states
+
+    def _backward_h(self, state, parent):
+        return self.start_assignment.lookup(state, parent).cost
+
+    def solve(self):
+        """Returns (pushes, explored), pushes as (box_cell, action) from the start state."""
+        forward, backward = self.forward, self.backward
+        if self.box_cnt < len(self.board.dest_cells):
+            return [], self.explored  # 箱子不够，填不满目的地
+        for state in forward.links:
+            if self._meets(state):
+                return self._stitch(state), self.explored
+
+        while True:
+            side = forward if len(forward.frontier) <= len(backward.frontier) else backward
+            state = side.pop()
+            if state is None:
+                side = backward if side is forward else forward
+                state = side.pop()
+                if state is None:
+                    return [], self.explored
+            self.explored.count += 1
+            self.progress(self.explored, side.frontier)
+
+            meet = self._expand_forward(state) if side is forward else self._expand_backward(state)
+            if meet is not None:
+                return self._stitch(meet), self.explored
+
+    def _expand_forward(self, state):
+        problem = self.problem
+        forward = self.forward
+        g = forward.g[state] + 1
+        for nxt, push, _ in problem.getSuccessors(state):
+            old = forward.g.get(nxt)
+            if old is not None and old <= g:
+                continue
+            forward.add(nxt, (state, push), g, self.heuristic(nxt, problem))
+            if self._meets(nxt):
+                return nxt
+        return None
+
+    def _meets(self, state):
+        if state in self.backward.links:
+            return True
+        # 反向不一定从所有目标状态出发，正向自己推到目标也算碰上
+        if self.problem.isGoalState(state):
+            self.backward.links[state] = None
+            return True
+        return False
+
+    def _expand_backward(self, state):
+        backward = self.backward
+        g = backward.g[state] + 1
+        for prev, push in self.board.pulls(state):
+            old = backward.g.get(prev)
+            if old is not None and old <= g:
+                continue
+            h = self._backward_h(prev, state)
+            if h >= deadlock.UNREACHABLE:
+                continue  # 箱子没法一一对应到开始位置
+            backward.add(prev, (state, push), g, h)
+            if prev in self.forward.links:
+                return prev
+        return None
+
+    def _stitch(self, meet):
+        pushes = []
+        state = meet
+        while self.forward.links[state]:
+            state, push = self.forward.links[state]
+            pushes.append(push)
+        pushes.reverse()
+
+        state = meet
+        while self.backward.links[state]:
+            state, push = self.backward.links[state]
+            pushes.append(push)
+        return pushes
+
+
+def bidirectionalSearch(problem, heuristic=search.nullHeuristic, progress=search.nullProgress):
+    """Push level search from the start and from the goal, see BidirectionalSearch."""
+    return BidirectionalSearch(problem, heuristic, progress).solve()
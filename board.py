@@ -0,0 +1,309 @@
+import copy
+import random
+
+import space
+
+
+class SokobanBoard(object):
+    """
+      The static part of a level: walls, destinations and cell ids. It is built
+      once per level and shared by every CompactState of that level.
+    """
+
+    def __init__(self, layout):
+        self.height = len(layout)
+        self.width = max([len(line) for line in layout]) if layout else 0
+
+        # 给所有静态空格的地方，赋予一个id，从下到上从左到右从0开始递增。非空格的话是-1
+        # 和deadlock.Deadlock的spaceid一致
+        self.cellid_layout = [[-1 for _ in line] for line in layout]
+        self.block_layout = [[c if space.is_static_block(c) else space.S_SPACE for c in line] for line in layout]
+        self.cell_to_pos = []
+        self.dest_mask = 0
+        cell_cnt = 0
+        for y, line in enumerate(layout):
+            for x, c in enumerate(line):
+                if not space.is_static_block(c):
+                    self.cellid_layout[y][x] = cell_cnt
+                    self.cell_to_pos.append((x, y))
+                    if space.is_dest(c):
+                        self.dest_mask |= 1 << cell_cnt
+                    cell_cnt += 1
+        self.cell_cnt = cell_cnt
+        self.box_bytes = (cell_cnt + 7) // 8
+        self.dest_cells = self.cells_of(self.dest_mask)
+
+        # zobrist随机数，种子固定，同一关在不同进程里也一样
+        rnd = random.Random(0)
+        self.zobrist_box = [rnd.getrandbits(64) for _ in range(cell_cnt)]
+        self.zobrist_man = [rnd.getrandbits(64) for _ in range(cell_cnt)]
+
+        # 每个方向上的邻居格子id，没有则是-1
+        self.neighbors = {}
+        for dx, dy in space.ACTIONS.values():
+            self.neighbors[(dx, dy)] = [self.cell_id(x + dx, y + dy) for x, y in self.cell_to_pos]
+        # (action, 前进方向的邻居, 后退方向的邻居)
+        self.action_steps = [(action, self.neighbors[(dx, dy)], self.neighbors[(-dx, -dy)])
+                             for action, (dx, dy) in space.ACTIONS.items()]
+        # 每个格子相邻的格子id
+        self.adjacent = [tuple([step[c] for _, step, _ in self.action_steps if step[c] >= 0])
+                         for c in range(cell_cnt)]
+
+    def cell_id(self, x, y):
+        if 0 <= y < self.height:
+            line = self.cellid_layout[y]
+            if 0 <= x < len(line):
+                return line[x]
+        return -1
+
+    def is_block(self, x, y):
+        return self.cell_id(x, y) < 0
+
+    def is_dest(self, x, y):
+        cid = self.cell_id(x, y)
+        return cid >= 0 and (self.dest_mask >> cid) & 1 == 1
+
+    def cells_of(self, mask):
+        cells = []
+        while mask:
+            low = mask & -mask
+            cells.append(low.bit_length() - 1)
+            mask ^= low
+        return cells
+
+    def reach(self, boxes, man):
+        """人从man出发不推箱子能走到的格子，返回(格子id列表, 是否可达的bytearray)"""
+        seen = bytearray(self.cell_cnt)
+        box_cells = self.cells_of(boxes)
+        for b in box_cells:
+            seen[b] = 1  # 箱子先当作走过的，最后再清掉
+        seen[man] = 1
+        cells = [man]
+        stack = [man]
+        adjacent = self.adjacent
+        while stack:
+            c = stack.pop()
+            for n in adjacent[c]:
+                if not seen[n]:
+                    seen[n] = 1
+                    cells.append(n)
+                    stack.append(n)
+        for b in box_cells:
+            seen[b] = 0
+        return cells, seen
+
+    def box_hash(self, boxes):
+        h = 0
+        zobrist_box = self.zobrist_box
+        for cid in self.cells_of(boxes):
+            h ^= zobrist_box[cid]
+        return h
+
+    def normalize(self, boxes, man, box_hash=None):
+        """人的可达区域用其中最小的格子id来代表，box_hash是箱子部分的zobrist值"""
+        cells, _ = self.reach(boxes, man)
+        man = min(cells)
+        if box_hash is None:
+            box_hash = self.box_hash(boxes)
+        return CompactState(self, boxes, man, box_hash ^ self.zobrist_man[man])
+
+    def pushes(self, state):
+        """
+          Push level successors of a normalized state: a list of
+          (nextState, (box_cell, action), new_box_pos), nextState normalized.
+        """
+        boxes = state.boxes
+        cells, _ = self.reach(boxes, state.man)
+        box_hash = state.zhash ^ self.zobrist_man[state.man]
+        zobrist_box = self.zobrist_box
+        successors = []
+        for c in cells:
+            for action, step, _ in self.action_steps:
+                n = step[c]
+                if n < 0 or not (boxes >> n) & 1:
+                    continue
+                nn = step[n]
+                if nn < 0 or (boxes >> nn) & 1:
+                    continue
+                nxt = self.normalize(boxes ^ (1 << n) | (1 << nn), n, box_hash ^ zobrist_box[n] ^ zobrist_box[nn])
+                successors.append((nxt, (n, action), self.cell_to_pos[nn]))
+        return successors
+
+    def pulls(self, state):
+        """
+          Push level predecessors of a normalized state, the man pulling a
+          box: a list of (prevState, (box_cell, action)), prevState normalized
+          and (box_cell, action) the push that leads from it back to state.
+        """
+        boxes = state.boxes
+        cells, _ = self.reach(boxes, state.man)
+        box_hash = state.zhash ^ self.zobrist_man[state.man]
+        zobrist_box = self.zobrist_box
+        predecessors = []
+        for c in cells:
+            for action, step, back in self.action_steps:
+                # 人在c，箱子在c前面，人退到c后面，箱子跟到c
+                b = step[c]
+                if b < 0 or not (boxes >> b) & 1:
+                    continue
+                m = back[c]
+                if m < 0 or (boxes >> m) & 1:
+                    continue
+                prev = self.normalize(boxes ^ (1 << b) | (1 << c), m, box_hash ^ zobrist_box[b] ^ zobrist_box[c])
+                predecessors.append((prev, (c, action)))
+        return predecessors
+
+    def with_dests(self, dest_mask):
+        """A copy of the board with other destinations, e.g. the start box cells for a backward search."""
+        other = copy.copy(self)
+        other.dest_mask = dest_mask
+        other.dest_cells = self.cells_of(dest_mask)
+        return other
+
+    def walk(self, boxes, src, dst):
+        """不推箱子从src走到dst的最短动作序列，走不到返回None"""
+        if src == dst:
+            return []
+        parent = {src: None}
+        frontier = [src]
+        while frontier:
+            nxt_frontier = []
+            for c in frontier:
+                for action, step, _ in self.action_steps:
+                    n = step[c]
+                    if n < 0 or n in parent or (boxes >> n) & 1:
+                        continue
+                    parent[n] = (c, action)
+                    if n == dst:
+                        actions = []
+                        while parent[n]:
+                            n, action = parent[n]
+                            actions.append(action)
+                        actions.reverse()
+                        return actions
+                    nxt_frontier.append(n)
+            frontier = nxt_frontier
+        return None
+
+    def expand_pushes(self, boxes, man, pushes):
+        """把(box_cell, action)的推箱子序列展开成l/r/u/d的动作序列"""
+        back = {action: back_step for action, _, back_step in self.action_steps}
+        forward = {action: step for action, step, _ in self.action_steps}
+        actions = []
+        for box, action in pushes:
+            walk = self.walk(boxes, man, back[action][box])
+            if walk is None:
+                raise Exception("push not reachable")
+            actions.extend(walk)
+            actions.append(action)
+            boxes = boxes ^ (1 << box) | (1 << forward[action][box])
+            man = box
+        return actions
+
+    def encode(self, state):
+        """定长的bytes: 箱子bitmask + 人的格子id"""
+        return state.boxes.to_bytes(self.box_bytes, 'big') + state.man.to_bytes(2, 'big')
+
+    def decode(self, data):
+        boxes = int.from_bytes(data[:self.box_bytes], 'big')
+        return CompactState(self, boxes, int.from_bytes(data[self.box_bytes:], 'big'))
+
+    def compact(self, state):
+        """Convert a space.SokobanState of this level into a CompactState."""
+        boxes = 0
+        for y, line in enumerate(state.layout):
+            for x, c in enumerate(line):
+                if c == space.S_BOX or c == space.S_BOX_AT_DEST:
+                    boxes |= 1 << self.cell_id(x, y)
+        x, y = state.man_pos
+        return CompactState(self, boxes, self.cell_id(x, y))
+
+    def expand(self, state):
+        """Convert a CompactState back into a space.SokobanState, e.g. for display."""
+        layout = []
+        for y, line in enumerate(self.cellid_layout):
+            row = []
+            for x, cid in enumerate(line):
+                if cid < 0:
+                    row.append(self.block_layout[y][x])
+                    continue
+                dest = (self.dest_mask >> cid) & 1 == 1
+                if (state.boxes >> cid) & 1:
+                    row.append(space.S_BOX_AT_DEST if dest else space.S_BOX)
+                elif cid == state.man:
+                    row.append(space.S_MAN_AT_DEST if dest else space.S_MAN)
+                else:
+                    row.append(space.S_DEST if dest else space.S_SPACE)
+            layout.append(row)
+        return space.SokobanState(layout, state.man_pos)
+
+
+class CompactState(object):
+    """
+      Solver side state: only the dynamic part of a level, the boxes as a
+      bitmask over the board's cell ids and the man's cell id.
+    """
+    __slots__ = ('board', 'boxes', 'man', 'zhash')
+
+    def __init__(self, board, boxes, man, zhash=None):
+        self.board = board
+        self.boxes = boxes
+        self.man = man
+        if zhash is None:
+            zhash = board.box_hash(boxes) ^ board.zobrist_man[man]
+        self.zhash = zhash
+
+    def __eq__(self, other):
+        # 先比较hash，绝大多数不相等的情况在这里就返回了
+        return other is not None and self.zhash == other.zhash and self.man == other.man and self.boxes == other.boxes
+
+    def __hash__(self):
+        return self.zhash
+
+    @property
+    def man_pos(self):
+        return self.board.cell_to_pos[self.man]
+
+    def box_cells(self):
+        return self.board.cells_of(self.boxes)
+
+    def box_positions(self):
+        cell_to_pos = self.board.cell_to_pos
+        return [cell_to_pos[cid] for cid in self.board.cells_of(self.boxes)]
+
+    def has_box(self, x, y):
+        cid = self.board.cell_id(x, y)
+        return cid >= 0 and (self.boxes >> cid) & 1 == 1
+
+    def has_space(self, x, y):
+        cid = self.board.cell_id(x, y)
+        return cid >= 0 and cid != self.man and (self.boxes >> cid) & 1 == 0
+
+    def copy(self):
+        return CompactState(self.board, self.boxes, self.man, self.zhash)
+
+    def try_move(self, dx, dy):
+        nxt, _ = self.try_move2(dx, dy)
+        return nxt
+
+    def try_move2(self, dx, dy):
+        bd = self.board
+        step = bd.neighbors[(dx, dy)]
+        n = step[self.man]
+        if n < 0:
+            return None, None
+
+        zhash = self.zhash ^ bd.zobrist_man[self.man] ^ bd.zobrist_man[n]
+        bit = 1 << n
+        if self.boxes & bit == 0:
+            return CompactState(bd, self.boxes, n, zhash), None
+
+        nn = step[n]
+        if nn < 0 or (self.boxes >> nn) & 1:
+            return None, None
+        zhash ^= bd.zobrist_box[n] ^ bd.zobrist_box[nn]
+        return CompactState(bd, self.boxes ^ bit | (1 << nn), n, zhash), bd.cell_to_pos[nn]
+
+    def is_finished(self):
+        dest_mask = self.board.dest_mask
+        return self.boxes & dest_mask == dest_mask
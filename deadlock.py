@@ -1,6 +1,13 @@
+import time
+
 import search
 import space
 
+try:
+    import numpy
+except ImportError:  # 没有numpy时用纯python的准备过程
+    numpy = None
+
 UNREACHABLE = 10000000
 
 
@@ -23,22 +30,48 @@ class Deadlock(object):
         self.spaceid_to_isdest = []
         self.spaceid_to_pos = []
 
-        # 静态空格到静态空格的距离矩阵
+        # 静态空格到静态空格的距离矩阵，有numpy时是int32的numpy数组
         self.distance_matrix = None
 
+        # 每个格子 ---> 能推到的目的地，bit i对应spaceid_to_dest_id的第i个目的地
+        self.dest_ids = []
+        self.spaceid_to_dest_mask = None
+
         # 每个格子 ---> area
         self.spaceid_to_area = None
 
+        # 推不到任何目的地的格子(dead square)，bit i对应spaceid i
+        self.dead_mask = 0
+
+        # 各准备阶段的耗时，秒
+        self.timings = {}
+
     def get_distance(self, from_pos, to_pos):
-        return self.distance_matrix[self._id(from_pos)][self._id(to_pos)]
+        return int(self.distance_matrix[self._id(from_pos)][self._id(to_pos)])
 
     def get_area(self, pos):
         return self.spaceid_to_area[self._id(pos)]
 
-    def prepare(self):
-        self._prepare_spaceid()
-        self._prepare_distance_matrix()
-        self._prepare_areas()
+    def prepare(self, use_numpy=True, store=None):
+        """store: a tablestore.TableStore, the tables are loaded from it if present and saved to it otherwise"""
+        use_numpy = use_numpy and numpy is not None
+        phases = [('spaceid', self._prepare_spaceid)]
+        if store is not None and store.contains(self.layout):
+            phases += [('load', lambda: store.load(self))]
+        else:
+            if use_numpy:
+                phases += [('distance', self._prepare_distance_matrix_numpy), ('areas', self._prepare_areas_numpy)]
+            else:
+                phases += [('distance', self._prepare_distance_matrix), ('areas', self._prepare_areas)]
+            phases += [('dead', self._prepare_dead_mask)]
+            if store is not None:
+                phases += [('save', lambda: store.save(self))]
+
+        self.timings = {}
+        for name, phase in phases:
+            t = time.perf_counter()
+            phase()
+            self.timings[name] = time.perf_counter() - t
 
     def _id(self, pos):
         x, y = pos
@@ -55,30 +88,90 @@ class Deadlock(object):
                     self.spaceid_to_pos.append((x, y))
                     space_cnt += 1
         self.space_cnt = space_cnt
-        self.distance_matrix = [[UNREACHABLE for _ in range(space_cnt)] for _ in range(space_cnt)]
+        self.dest_ids = [i for i, isdest in enumerate(self.spaceid_to_isdest) if isdest]
 
     def _prepare_distance_matrix(self):
+        self.distance_matrix = [[UNREACHABLE for _ in range(self.space_cnt)] for _ in range(self.space_cnt)]
         for y, line in enumerate(self.spaceid_layout):
             for x, spaceid in enumerate(line):
                 if spaceid > -1:
                     self._prepare_one(x, y, spaceid)
 
     def _prepare_one(self, x, y, spaceid):
-        problem = PushBoxProblem(self.spaceid_layout, spaceid, x, y)
+        problem = PushBoxProblem(self.spaceid_layout, spaceid, x, y, self.spaceid_to_pos)
         exploredDict = problem.solve()
-        for state, solution in exploredDict.items():
+        for state, depth in exploredDict.items():
             to_spaceid = state[0]
-            self.distance_matrix[spaceid][to_spaceid] = len(solution)
+            self.distance_matrix[spaceid][to_spaceid] = depth
+
+    def _push_edges(self):
+        # 箱子能从格子src推到dst: 对每个方向，目标格子和人站的格子都是空间
+        edges = []
+        for dx, dy in space.ACTIONS.values():
+            src = []
+            dst = []
+            for spaceid, (x, y) in enumerate(self.spaceid_to_pos):
+                nid = self.spaceid_layout[y + dy][x + dx]
+                if nid > -1 and self.spaceid_layout[y - dy][x - dx] > -1:
+                    src.append(spaceid)
+                    dst.append(nid)
+            edges.append((numpy.array(src, dtype=numpy.intp), numpy.array(dst, dtype=numpy.intp)))
+        return edges
+
+    def _prepare_distance_matrix_numpy(self):
+        # 从所有格子同时做BFS，frontier[i, j]表示从i出发这一层到了j
+        n = self.space_cnt
+        edges = self._push_edges()
+        distance = numpy.full((n, n), UNREACHABLE, dtype=numpy.int32)
+        numpy.fill_diagonal(distance, 0)
+        reached = numpy.eye(n, dtype=bool)
+        frontier = reached.copy()
+        depth = 0
+        while frontier.any():
+            depth += 1
+            nxt = numpy.zeros((n, n), dtype=bool)
+            for src, dst in edges:
+                # 同一方向上的dst不会重复
+                nxt[:, dst] |= frontier[:, src]
+            nxt &= ~reached
+            reached |= nxt
+            distance[nxt] = depth
+            frontier = nxt
+        self.distance_matrix = distance
+
+    def _prepare_areas_numpy(self):
+        reach_dest = self.distance_matrix[:, self.dest_ids] < UNREACHABLE  # 格子 x 目的地
+        packed = numpy.packbits(reach_dest, axis=1, bitorder='little')
+        self.spaceid_to_dest_mask = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+
+        # 目的格子集合 ---> area，area里是能到的目的地是它子集的格子
+        masks = sorted({mask for mask in self.spaceid_to_dest_mask if mask})
+        areas = [Area(bin(mask).count('1')) for mask in masks]
+        if masks:
+            area_dests = numpy.array([[(mask >> i) & 1 for i in range(len(self.dest_ids))] for mask in masks],
+                                     dtype=numpy.int32)
+            outside = reach_dest.astype(numpy.int32) @ (1 - area_dests).T  # 格子能到area之外的目的地的个数
+            has_dest = reach_dest.any(axis=1)
+            for a, area in enumerate(areas):
+                members = numpy.nonzero((outside[:, a] == 0) & has_dest)[0]
+                area.positions = [self.spaceid_to_pos[i] for i in members]
+
+        mask_to_area = dict(zip(masks, areas))
+        self.spaceid_to_area = [mask_to_area[mask] if mask else DEADLOCK_AREA
+                                for mask in self.spaceid_to_dest_mask]
 
     def _prepare_areas(self):
         # 每个空格 ---> 可到达的目的格子集合
         from_to_reachable_dests = {}
+        self.spaceid_to_dest_mask = [0] * self.space_cnt
+        dest_bits = {dest_id: 1 << i for i, dest_id in enumerate(self.dest_ids)}
         for from_id in range(self.space_cnt):
             reachable_dests = []
             for to_id in range(self.space_cnt):
                 distance = self.distance_matrix[from_id][to_id]
                 if distance < UNREACHABLE and self.spaceid_to_isdest[to_id]:
                     reachable_dests.append(to_id)
+                    self.spaceid_to_dest_mask[from_id] |= dest_bits[to_id]
 
             if reachable_dests:
                 from_to_reachable_dests[from_id] = tuple(reachable_dests)
@@ -97,19 +190,26 @@ class Deadlock(object):
                     area.positions.append(self.spaceid_to_pos[from_id])
 
         # 转化为spaceid_to_area
-        self.spaceid_to_area = {}
+        self.spaceid_to_area = []
         for from_id in range(self.space_cnt):
             if from_id in from_to_reachable_dests:
                 reachable_dests = from_to_reachable_dests[from_id]
                 area = dests_to_area[reachable_dests]
-                self.spaceid_to_area[from_id] = area
+                self.spaceid_to_area.append(area)
             else:
-                self.spaceid_to_area[from_id] = DEADLOCK_AREA
+                self.spaceid_to_area.append(DEADLOCK_AREA)
+
+    def _prepare_dead_mask(self):
+        self.dead_mask = 0
+        for spaceid, area in enumerate(self.spaceid_to_area):
+            if area is DEADLOCK_AREA:
+                self.dead_mask |= 1 << spaceid
 
 
 class PushBoxProblem(search.SearchProblem):
-    def __init__(self, spaceid_layout, startid, x, y):
+    def __init__(self, spaceid_layout, startid, x, y, spaceid_to_pos=None):
         self.spaceid_layout = spaceid_layout
+        self.spaceid_to_pos = spaceid_to_pos  # decodeState要用
         self.start = (startid, x, y)  # 加入id，方便提取exploredDict
 
     def getStartState(self):
@@ -132,7 +232,15 @@ class PushBoxProblem(search.SearchProblem):
 
         return successors
 
+    def encodeState(self, state):
+        return state[0].to_bytes(2, 'big')
+
+    def decodeState(self, data):
+        spaceid = int.from_bytes(data, 'big')
+        x, y = self.spaceid_to_pos[spaceid]
+        return spaceid, x, y
+
     def solve(self):
-        actions, exploredDict = search.bfs(self)
+        actions, explored = search.lsbfs(self)
         assert len(actions) == 0
-        return exploredDict
+        return dict(explored.items())
@@ -0,0 +1,233 @@
+import os
+import sys
+import heapq
+import shutil
+import tempfile
+
+import search
+
+DEFAULT_RAM_BUDGET = 256 * 1024 * 1024
+READ_RECORDS = 4096  # 一次顺序读多少条记录
+
+
+class Bucket(object):
+    """
+      The states of one (g, h) bucket: sorted run files on disk plus the
+      records generated since the last flush. Every expansion of the bucket
+      leaves a sorted, duplicate free closed file.
+    """
+    __slots__ = ('g', 'h', 'runs', 'buffer', 'generated', 'closed')
+
+    def __init__(self, g, h):
+        self.g = g
+        self.h = h
+        self.runs = []
+        self.buffer = []
+        self.generated = 0  # 还没展开的记录数，含重复
+        self.closed = []
+
+    def is_open(self):
+        return self.generated > 0
+
+
+class ExternalAStar(object):
+    """
+      A* whose open and closed lists live in spill_dir. States are fixed
+      width records from problem.encodeState, grouped into (g, h) buckets
+      and expanded by increasing f, and by increasing g within an f.
+
+      Successors are buffered in memory. When the buffers reach ram_budget
+      bytes, each is sorted and written as a run file of its bucket.
+      Duplicates are removed in batches, not per state: before a bucket is
+      expanded its runs are merged, and the states already in a closed
+      bucket with the same h are merged out. A state's h never changes, so
+      this finds every duplicate. All file access is sequential.
+
+      The path is rebuilt backwards from the goal. In each closed bucket of
+      depth g - 1, a state is looked for that has the current state as a
+      successor. Step costs must be 1, and h consistent for the first
+      solution to be shortest.
+    """
+
+    def __init__(self, problem, heuristic=search.nullHeuristic, progress=search.nullProgress,
+                 spill_dir=None, ram_budget=DEFAULT_RAM_BUDGET):
+        self.problem = problem
+        self.heuristic = heuristic or search.nullHeuristic
+        self.progress = progress or search.nullProgress
+        self.spill_dir = spill_dir
+        self.ram_budget = ram_budget
+
+        self.buckets = {}  # (g, h) -> Bucket
+        self.closed_by_h = {}  # h -> 这个h的所有closed文件
+        self.buffered = 0  # 内存里缓存的字节数
+        self.width = 0
+        self.record_bytes = 0  # 缓存一条记录实际占的内存: bytes对象加上list里的一个指针
+        self.directory = None
+        self.explored = search.ExploredCounter()
+        self.frontier = search.ExploredCounter()  # 生成了还没展开的状态数，有重复
+        self.written = 0  # 写盘的字节数
+        self.read = 0
+
+    def solve(self):
+        os.makedirs(self.spill_dir or tempfile.gettempdir(), exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix='external_astar', dir=self.spill_dir)
+        try:
+            return self._search(), self.explored
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _search(self):
+        problem = self.problem
+        start = problem.getStartState()
+        record = problem.encodeState(start)
+        self.width = len(record)
+        self.record_bytes = sys.getsizeof(record) + 8
+        self._add(0, self.heuristic(start, problem), record)
+
+        while True:
+            f = self._min_f()
+            if f is None:
+                return []
+            g = 0
+            while g <= f:
+                bucket = self.buckets.get((g, f - g))
+                if bucket is not None and bucket.is_open():
+                    goal = self._expand(bucket)
+                    if goal is not None:
+                        return self._rebuild(bucket.g, goal)
+                g += 1
+
+    def _min_f(self):
+        fs = [g + h for (g, h), bucket in self.buckets.items() if bucket.is_open()]
+        return min(fs) if fs else None
+
+    def _add(self, g, h, record):
+        bucket = self.buckets.get((g, h))
+        if bucket is None:
+            bucket = Bucket(g, h)
+            self.buckets[(g, h)] = bucket
+        bucket.buffer.append(record)
+        bucket.generated += 1
+        self.frontier.count += 1
+        self.buffered += self.record_bytes
+        if self.buffered >= self.ram_budget:
+            self._flush()
+
+    def _flush(self):
+        for bucket in self.buckets.values():
+            if bucket.buffer:
+                name = 'run{0}_{1}'.format(len(bucket.closed), len(bucket.runs))
+                bucket.runs.append(self._write(bucket, name, sorted(set(bucket.buffer))))
+                bucket.buffer = []
+        self.buffered = 0
+
+    def _path(self, bucket, name):
+        return os.path.join(self.directory, '{0}_{1}_{2}'.format(bucket.g, bucket.h, name))
+
+    def _write(self, bucket, name, records):
+        path = self._path(bucket, name)
+        with open(path, 'wb') as f:
+            for i in range(0, len(records), READ_RECORDS):
+                data = b''.join(records[i:i + READ_RECORDS])
+                f.write(data)
+                self.written += len(data)
+        return path
+
+    def _records(self, path):
+        # 顺序读一个排好序的文件
+        width = self.width
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(width * READ_RECORDS)
+                if not data:
+                    return
+                self.read += len(data)
+                for i in range(0, len(data), width):
+                    yield data[i:i + width]
+
+    def _open_records(self, bucket, runs):
+        # 合并各个run，去掉重复的，再去掉同一个h已经展开过的
+        runs = [self._records(path) for path in runs]
+        runs.append(iter(sorted(set(bucket.buffer))))
+        self.buffered -= len(bucket.buffer) * self.width
+        bucket.buffer = []
+
+        closed = heapq.merge(*[self._records(path) for path in self.closed_by_h.get(bucket.h, [])])
+        old = next(closed, None)
+        last = None
+        for record in heapq.merge(*runs):
+            if record == last:
+                continue
+            last = record
+            while old is not None and old < record:
+                old = next(closed, None)
+            if old != record:
+                yield record
+
+    def _expand(self, bucket):
+        """Expand every state of bucket, returning the record of a goal state if one is found."""
+        problem = self.problem
+        heuristic = self.heuristic
+        encode = problem.encodeState
+
+        self.frontier.count -= bucket.generated
+        bucket.generated = 0
+        runs = bucket.runs
+        bucket.runs = []
+        # h不一致时同一个桶可能再次收到状态，每次展开都留一个closed文件
+        path = self._path(bucket, 'closed{0}'.format(len(bucket.closed)))
+        goal = None
+        with open(path, 'wb') as closed:
+            # 边合并边写closed文件边展开，桶再大也不用全读进内存
+            for record in self._open_records(bucket, runs):
+                closed.write(record)
+                self.written += len(record)
+                state = problem.decodeState(record)
+                if problem.isGoalState(state):
+                    goal = record
+                    break
+                self.explored.count += 1
+                self.progress(self.explored, self.frontier)
+                for nextState, action, stepCost in problem.getSuccessors(state):
+                    self._add(bucket.g + stepCost, heuristic(nextState, problem), encode(nextState))
+        for run in runs:
+            os.remove(run)
+        bucket.closed.append(path)
+        self.closed_by_h.setdefault(bucket.h, []).append(path)
+        return goal
+
+    def _rebuild(self, g, record):
+        actions = []
+        while g > 0:
+            g -= 1
+            parent = None
+            for bucket in self.buckets.values():
+                if bucket.g == g:
+                    parent, action = self._find_parent(bucket, record)
+                    if parent is not None:
+                        break
+            if parent is None:
+                raise Exception("no parent found in depth {0}".format(g))
+            actions.append(action)
+            record = parent
+        actions.reverse()
+        return actions
+
+    def _find_parent(self, bucket, record):
+        problem = self.problem
+        encode = problem.encodeState
+        for path in bucket.closed:
+            for parent in self._records(path):
+                for nextState, action, stepCost in problem.getSuccessors(problem.decodeState(parent)):
+                    if encode(nextState) == record:
+                        return parent, action
+        return None, None
+
+
+def externalAStarSearch(problem, heuristic=search.nullHeuristic, progress=search.nullProgress,
+                        spillDir=None, ramBudget=DEFAULT_RAM_BUDGET):
+    """
+      A* with the open and closed lists on disk, see ExternalAStar.
+      Returns (actions, explored).
+    """
+    return ExternalAStar(problem, heuristic, progress, spillDir, ramBudget).solve()
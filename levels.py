@@ -0,0 +1,205 @@
+import os
+import collections.abc
+
+import space
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res', 'map.txt')
+
+FORMAT_MAP = 'map'  # res/map.txt: [maps]段里每关以M开头
+FORMAT_XSB = 'xsb'  # 标准的XSB/.sok
+
+MAP_SIGNS = {'+': space.S_WALL,
+             ' ': space.S_SPACE,
+             '-': space.S_OUTSIZE,
+             '#': space.S_BOX,
+             '@': space.S_BOX_AT_DEST,
+             '.': space.S_DEST,
+             '^': space.S_MAN,
+             '$': space.S_MAN_AT_DEST}
+
+XSB_SIGNS = {'#': space.S_WALL,
+             ' ': space.S_SPACE,
+             '-': space.S_SPACE,
+             '_': space.S_SPACE,
+             '$': space.S_BOX,
+             '*': space.S_BOX_AT_DEST,
+             '.': space.S_DEST,
+             '@': space.S_MAN,
+             '+': space.S_MAN_AT_DEST}
+_XSB_CHARS = frozenset(XSB_SIGNS) | frozenset('0123456789|')
+
+
+def detect_format(path):
+    """FORMAT_MAP for files with a [maps] section like res/map.txt, FORMAT_XSB otherwise."""
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip() == b'[maps]':
+                return FORMAT_MAP
+    return FORMAT_XSB
+
+
+def is_xsb_row(text):
+    text = text.rstrip()
+    return bool(text) and '#' in text and all([c in _XSB_CHARS for c in text])
+
+
+def _map_row(text):
+    return bool(text) and text[0] in MAP_SIGNS
+
+
+def unrle(text):
+    """Expand run length encoded XSB, '3#' is '###' and '|' separates rows. Returns the rows."""
+    rows = ['']
+    count = ''
+    for c in text:
+        if c.isdigit():
+            count += c
+        elif c == '|':
+            rows.append('')
+            count = ''
+        else:
+            rows[-1] += c * int(count or 1)
+            count = ''
+    return rows
+
+
+def _state(layout):
+    # 和SokobanLoader一样，layout从下往上，第0行是最下面一行
+    man = None
+    for y, line in enumerate(layout):
+        for x, idx in enumerate(line):
+            if idx == space.S_MAN or idx == space.S_MAN_AT_DEST:
+                if man:
+                    raise Exception("multiple man")
+                man = (x, y)
+    if man is None:
+        raise Exception("man not found")
+    return space.SokobanState(layout, man)
+
+
+def parse_map(lines):
+    """A level of res/map.txt from its row lines, top row first."""
+    layout = []
+    for line in lines:
+        if _map_row(line):
+            layout.insert(0, [MAP_SIGNS[s] for s in line.strip()])
+    return _state(layout)
+
+
+def parse_xsb(lines):
+    """
+      A level in XSB from its row lines, top row first. Rows are padded to
+      the same width and floor the man cannot reach from his start, walls
+      taken as the only obstacles, becomes outside.
+    """
+    rows = []
+    for line in lines:
+        if is_xsb_row(line):
+            rows.extend(unrle(line.rstrip()))
+    width = max([len(row) for row in rows]) if rows else 0
+    grid = [[XSB_SIGNS[c] for c in row] + [space.S_SPACE] * (width - len(row)) for row in rows]
+
+    start = None
+    for y, row in enumerate(grid):
+        for x, c in enumerate(row):
+            if c == space.S_MAN or c == space.S_MAN_AT_DEST:
+                start = (x, y)
+    inside = set()
+    stack = [start] if start else []
+    while stack:
+        x, y = stack.pop()
+        if (x, y) in inside or not (0 <= y < len(grid) and 0 <= x < width) or grid[y][x] == space.S_WALL:
+            continue
+        inside.add((x, y))
+        stack.extend([(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)])
+    for y, row in enumerate(grid):
+        for x, c in enumerate(row):
+            if c == space.S_SPACE and (x, y) not in inside:
+                row[x] = space.S_OUTSIZE
+
+    grid.reverse()
+    return _state(grid)
+
+
+class LevelCollection(collections.abc.Sequence):
+    """
+      The levels of a res/map.txt style or XSB/.sok file, without pyglet.
+      The file is scanned once for the byte range of every level; a level
+      is only read and parsed when it is asked for, so load(n) reads one
+      level and iterating streams through the file.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, format=None):
+        self.path = path
+        self.format = format or detect_format(path)
+        self.parse = parse_map if self.format == FORMAT_MAP else parse_xsb
+        self.offsets = self._index()  # 每关的(开始, 结束)字节位置
+
+    def _index(self):
+        if self.format == FORMAT_MAP:
+            return self._index_map()
+        return self._index_xsb()
+
+    def _index_map(self):
+        # 和SokobanLoader.load_maps一样，第一个M之前的都跳过，M开始新的一关
+        offsets = []
+        begin = end = None
+        started = False
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for raw in f:
+                line = raw.decode('latin-1')
+                if line.startswith('M'):
+                    if started and begin is not None:
+                        offsets.append((begin, end))
+                        begin = None
+                    started = True
+                elif started and _map_row(line):
+                    if begin is None:
+                        begin = offset
+                    end = offset + len(raw)
+                offset += len(raw)
+        if begin is not None:
+            offsets.append((begin, end))
+        return offsets
+
+    def _index_xsb(self):
+        # 连续的地图行是一关，标题和注释行把关分开
+        offsets = []
+        begin = end = None
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for raw in f:
+                if is_xsb_row(raw.decode('latin-1')):
+                    if begin is None:
+                        begin = offset
+                    end = offset + len(raw)
+                elif begin is not None:
+                    offsets.append((begin, end))
+                    begin = None
+                offset += len(raw)
+        if begin is not None:
+            offsets.append((begin, end))
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self.load(i) for i in range(*n.indices(len(self)))]
+        return self.load(n)
+
+    def load(self, n):
+        """The space.SokobanState of level n."""
+        begin, end = self.offsets[n]
+        with open(self.path, 'rb') as f:
+            f.seek(begin)
+            data = f.read(end - begin)
+        return self.parse(data.decode('latin-1').splitlines())
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            for begin, end in self.offsets:
+                f.seek(begin)
+                yield self.parse(f.read(end - begin).decode('latin-1').splitlines())
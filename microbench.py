@@ -0,0 +1,323 @@
+import gc
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+import collections
+
+import util
+import space
+import levels
+import search
+import solver
+
+FIXTURE_LEVELS = (2, 5, 20)  # 从这几关取状态做测试数据
+FIXTURE_STATES = 500  # 每关取多少个状态
+QUEUE_SIZE = 1000
+REPEAT = 5
+MIN_SECONDS = 0.5  # 每个测试至少跑这么久，短的操作多跑几次
+MAX_RUNS = 1000
+MARGIN = 0.25  # 保存阈值时在测出的时间上加多少余量
+ALLOC_SLACK = 16  # 分配的字节数超过阈值这么多才算失败，小整数、缓存之类会有一点抖动
+DEFAULT_THRESHOLDS = os.environ.get('SOKOBAN_MICROBENCH', 'microbench.json')
+
+BENCHES = collections.OrderedDict()  # 名字 -> setup(fixtures)，返回(func, 参数列表)
+
+
+def bench(name):
+    """Register setup under name. setup(fixtures) returns (func, args); one op is func(*a) for a in args."""
+    def register(setup):
+        BENCHES[name] = setup
+        return setup
+    return register
+
+
+class Fixtures(object):
+    """States taken from real levels: a breadth first sweep of CompactStates and a random walk of SokobanStates."""
+
+    def __init__(self, numbers=FIXTURE_LEVELS, count=FIXTURE_STATES, seed=0):
+        layouts = levels.LevelCollection()
+        rnd = random.Random(seed)
+        self.problems = []
+        self.compact = []  # (problem, CompactState)
+        self.states = []  # space.SokobanState
+        for level in numbers:
+            problem = solver.SokobanSearchProblem(layouts[level], algorithm=solver.ASTAR_DEADLOCK)
+            self.problems.append(problem)
+            self.compact.extend([(problem, s) for s in self._sweep(problem, count)])
+            self.states.extend(self._walk(layouts[level], count, rnd))
+
+        # 推了箱子的移动，is_deadlock的参数
+        self.pushes = []
+        for problem, state in self.compact:
+            for dx, dy in space.ACTIONS.values():
+                nxt, new_box_pos = state.try_move2(dx, dy)
+                if new_box_pos:
+                    self.pushes.append((problem, nxt, new_box_pos))
+
+        # (problem, parent, child)，sokobanHeuristic的增量计算
+        self.children = []
+        for problem, state in self.compact:
+            for nxt, _, _ in problem.getSuccessors(state):
+                self.children.append((problem, state, nxt))
+
+    @staticmethod
+    def _sweep(problem, count):
+        start = problem.getStartState()
+        seen = {start}
+        queue = collections.deque([start])
+        while queue and len(seen) < count:
+            for nxt, _, _ in problem.getSuccessors(queue.popleft()):
+                if nxt not in seen:
+                    seen.add(nxt)
+                    queue.append(nxt)
+        return list(seen)[:count]
+
+    @staticmethod
+    def _walk(state, count, rnd):
+        states = [state]
+        directions = list(space.ACTIONS.values())
+        while len(states) < count:
+            nxt = state.try_move(*rnd.choice(directions))
+            if nxt is not None:
+                state = nxt
+                states.append(state)
+        return states
+
+
+def _directions(states):
+    return [(s, dx, dy) for s in states for dx, dy in space.ACTIONS.values()]
+
+
+@bench('SokobanState.try_move2')
+def _bench_state_move(fx):
+    return space.SokobanState.try_move2, _directions(fx.states)
+
+
+@bench('SokobanState.copy')
+def _bench_state_copy(fx):
+    return space.SokobanState.copy, [(s,) for s in fx.states]
+
+
+@bench('SokobanState.__hash__')
+def _bench_state_hash(fx):
+    return hash, [(s,) for s in fx.states]
+
+
+@bench('SokobanState.is_finished')
+def _bench_state_finished(fx):
+    return space.SokobanState.is_finished, [(s,) for s in fx.states]
+
+
+@bench('CompactState.try_move2')
+def _bench_compact_move(fx):
+    return type(fx.compact[0][1]).try_move2, _directions([s for _, s in fx.compact])
+
+
+@bench('CompactState.copy')
+def _bench_compact_copy(fx):
+    return type(fx.compact[0][1]).copy, [(s,) for _, s in fx.compact]
+
+
+@bench('CompactState.__hash__')
+def _bench_compact_hash(fx):
+    return hash, [(s,) for _, s in fx.compact]
+
+
+@bench('CompactState.is_finished')
+def _bench_compact_finished(fx):
+    return type(fx.compact[0][1]).is_finished, [(s,) for _, s in fx.compact]
+
+
+@bench('sokobanHeuristic')
+def _bench_heuristic(fx):
+    # 分配已经在缓存里，搜索中同一组箱子再次出现时的情况
+    for problem, state in fx.compact:
+        solver.sokobanHeuristic(state, problem)
+    return solver.sokobanHeuristic, [(s, p) for p, s in fx.compact]
+
+
+@bench('sokobanHeuristic.incremental')
+def _bench_heuristic_incremental(fx):
+    # 父状态的分配在缓存里，子状态的从它修正出来
+    for problem in fx.problems:
+        problem.assignment.clear()
+    for problem, parent, _ in fx.children:
+        problem.expanding = None
+        solver.sokobanHeuristic(parent, problem)
+
+    def heuristic(problem, parent, child):
+        problem.expanding = parent
+        return solver.sokobanHeuristic(child, problem)
+    return heuristic, fx.children
+
+
+@bench('is_deadlock')
+def _bench_deadlock(fx):
+    return solver.SokobanSearchProblem.is_deadlock, fx.pushes
+
+
+def _queue_items(fx, rnd):
+    # A*的节点[state, parent, action, g, h]，优先级是小整数
+    items = []
+    for _, state in fx.compact[:QUEUE_SIZE]:
+        g, h = rnd.randrange(100), rnd.randrange(50)
+        items.append(([state, None, None, g, h], g + h))
+    return items
+
+
+def _queue_benches(name, factory):
+    @bench(name + '.push')
+    def push(fx):
+        q = factory()
+        return q.push, _queue_items(fx, random.Random(0))
+
+    @bench(name + '.pop')
+    def pop(fx):
+        q = factory()
+        for item, priority in _queue_items(fx, random.Random(0)):
+            q.push(item, priority)
+        return q.pop, [()] * len(q)
+
+    @bench(name + '.update')
+    def update(fx):
+        # 一半是降低已有节点的优先级，一半是新节点
+        q = factory()
+        rnd = random.Random(0)
+        items = _queue_items(fx, rnd)
+        for item, priority in items[::2]:
+            q.push(item, priority)
+        return q.update, [(item, priority - 1 if i % 2 == 0 else priority) for i, (item, priority) in enumerate(items)]
+
+
+_queue_benches('PriorityQueue', util.PriorityQueue)
+_queue_benches('IndexedPriorityQueue', util.IndexedPriorityQueue)
+_queue_benches('BucketPriorityQueue', lambda: util.BucketPriorityQueue(tiebreak=search.nodeHeuristic))
+
+
+def _noop(*args):
+    pass
+
+
+def _time(func, args):
+    gc.disable()
+    try:
+        t = time.perf_counter_ns()
+        for a in args:
+            func(*a)
+        return time.perf_counter_ns() - t
+    finally:
+        gc.enable()
+
+
+def _allocated(func, args):
+    # 每个操作开始时清掉峰值，峰值减去开始时的用量就是这次操作分配的字节数，临时对象也算
+    out = [None] * len(args)
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        total = 0
+        for i, a in enumerate(args):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            out[i] = func(*a)
+            total += tracemalloc.get_traced_memory()[1] - before
+        return total
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+
+
+def measure(setup, fx, repeat=REPEAT):
+    """
+      (ops, ns per op, bytes allocated per op) of one benchmark. The time is
+      the best of at least repeat runs, and more until MIN_SECONDS are spent,
+      each on a fresh setup, minus the best time of calling an empty function
+      with the same arguments. The bytes are the peak traced by tracemalloc
+      during each op above what was in use when it started, so temporary
+      objects count as well as the result, minus the same for the empty
+      function.
+    """
+    best = overhead = None
+    runs = 0
+    spent = 0
+    while runs < repeat or (spent < MIN_SECONDS * 1e9 and runs < MAX_RUNS):
+        func, args = setup(fx)
+        elapsed = _time(func, args)
+        empty = _time(_noop, args)
+        spent += elapsed
+        best = elapsed if best is None else min(best, elapsed)
+        overhead = empty if overhead is None else min(overhead, empty)
+        runs += 1
+    func, args = setup(fx)
+    allocated = _allocated(func, args) - _allocated(_noop, args)
+    n = len(args)
+    return n, max(best - overhead, 0) / n, max(allocated, 0) / n
+
+
+def check(name, ns, allocated, thresholds):
+    """A text describing why ns or allocated bytes exceed the stored threshold of name, or None."""
+    limit = thresholds.get(name)
+    if limit is None:
+        return None
+    if ns > limit['ns']:
+        return "{0:.0f} ns/op > {1:.0f}".format(ns, limit['ns'])
+    if 'bytes' in limit and allocated > limit['bytes'] + ALLOC_SLACK:  # 以前存的阈值没有bytes，只比时间
+        return "{0:.0f} B/op > {1:.0f}".format(allocated, limit['bytes'])
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量搜索里最常用的几个操作的ns/op和每次操作分配的字节数")
+    parser.add_argument('names', nargs='*', help="只跑名字里包含这些字符串的测试")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="每个测试跑几次，取最快的")
+    parser.add_argument('--thresholds', default=DEFAULT_THRESHOLDS, help="阈值的JSON文件")
+    parser.add_argument('--save', action='store_true', help="把这次的结果加上余量存为阈值")
+    parser.add_argument('--margin', type=float, default=MARGIN, help="存阈值时加的余量，0.25即25%%")
+    parser.add_argument('--list', action='store_true', help="只列出测试的名字")
+    args = parser.parse_args()
+
+    names = [n for n in BENCHES if not args.names or any([s in n for s in args.names])]
+    if args.list:
+        print("\n".join(names))
+        return
+
+    thresholds = {}
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+
+    fx = Fixtures()
+    print("关卡{0}，{1}个状态".format(",".join([str(lvl) for lvl in FIXTURE_LEVELS]), len(fx.compact)))
+    measured = {}
+    failed = []
+    for name in names:
+        n, ns, allocated = measure(BENCHES[name], fx, args.repeat)
+        measured[name] = {'ns': ns, 'bytes': allocated}
+        problem = None if args.save else check(name, ns, allocated, thresholds)
+        if problem:
+            failed.append(name)
+        limit = thresholds.get(name)
+        print("{0:<36} {1:>7} ops {2:>10.1f} ns/op {3:>8.1f} B/op  {4}".format(
+            name, n, ns, allocated, "FAIL " + problem if problem else
+            "limit {0:.0f} ns".format(limit['ns']) if limit else ""))
+
+    if args.save:
+        for name, m in measured.items():
+            thresholds[name] = {'ns': round(m['ns'] * (1 + args.margin), 1), 'bytes': round(m['bytes'], 1)}
+        tmp = args.thresholds + '.tmp{0}'.format(os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(thresholds, f, indent=1, sort_keys=True)
+        os.replace(tmp, args.thresholds)
+        print("阈值存到了{0}".format(args.thresholds))
+    elif failed:
+        print("{0}个操作比阈值慢: {1}".format(len(failed), ", ".join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
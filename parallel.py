@@ -0,0 +1,334 @@
+import time
+import heapq
+import struct
+import multiprocessing
+
+import space
+import search
+
+INF = 1 << 62
+RING_CAPACITY = 1 << 14  # 每对worker之间的环形缓冲最多放多少条消息
+RING_BUDGET = 64 * 1024 * 1024  # 所有环形缓冲加起来的字节数，worker多了每个环就小一些
+BATCH = 64  # 攒够这么多条再写进环形缓冲
+EXPAND_BATCH = 32  # 两次收消息之间最多展开几个状态
+BACKLOG = 4 * BATCH  # 发不出去的消息积压到这么多就先不展开
+ACTION_CHARS = list(space.ACTIONS)
+AVAILABLE = 'fork' in multiprocessing.get_all_start_methods()  # windows上没有fork，用不了
+
+
+class RingBuffer(object):
+    """
+      A single producer, single consumer queue of fixed width messages in
+      shared memory. counters[0] is the consumer's head and counters[1] the
+      producer's tail; each side only writes its own counter, so no lock is
+      needed.
+    """
+
+    def __init__(self, ctx, width, capacity=RING_CAPACITY):
+        self.width = width
+        self.capacity = capacity
+        self.raw = ctx.RawArray('B', width * capacity)
+        self.counters = ctx.RawArray('q', 2)
+        self.data = memoryview(self.raw).cast('B')
+
+    def room(self):
+        return self.capacity - (self.counters[1] - self.counters[0])
+
+    def put(self, messages):
+        """Write as many of messages as fit, returns how many were written."""
+        tail = self.counters[1]
+        n = min(self.room(), len(messages))
+        width = self.width
+        data = self.data
+        for k in range(n):
+            pos = (tail + k) % self.capacity * width
+            data[pos:pos + width] = messages[k]
+        self.counters[1] = tail + n  # 数据写完再移动tail
+        return n
+
+    def has_data(self):
+        return self.counters[1] != self.counters[0]
+
+    def get(self):
+        head, tail = self.counters[0], self.counters[1]
+        width = self.width
+        data = self.data
+        messages = []
+        for k in range(head, tail):
+            pos = k % self.capacity * width
+            messages.append(bytes(data[pos:pos + width]))
+        self.counters[0] = tail
+        return messages
+
+
+class Shared(object):
+    """The state shared by the coordinator and all workers."""
+
+    def __init__(self, ctx, workers, width):
+        self.workers = workers
+        self.width = width  # 一个编码后的状态的字节数
+        self.message = struct.Struct('<{0}s{0}siiHB'.format(width))  # 状态, 父状态, g, h, 推的格子, 动作
+        # 一共workers*(workers-1)个环，按总预算分，至少放得下一批
+        capacity = RING_BUDGET // (workers * workers * self.message.size)
+        capacity = max(BATCH, min(RING_CAPACITY, capacity))
+        self.rings = [[RingBuffer(ctx, self.message.size, capacity) if i != j else None for j in range(workers)]
+                      for i in range(workers)]  # rings[发送者][接收者]
+        self.sent = ctx.RawArray('q', workers)
+        self.received = ctx.RawArray('q', workers)
+        self.expanded = ctx.RawArray('q', workers)
+        self.frontier = ctx.RawArray('q', workers)
+        self.idle = ctx.RawArray('b', workers)
+        self.done = ctx.RawValue('b', 0)
+        self.lock = ctx.Lock()
+        self.incumbent = ctx.RawValue('q', INF)  # 目前找到的最好解的长度
+        self.goal = ctx.RawArray('B', width)
+
+    def wave(self):
+        """One pass over the workers: whether every one was idle, and the sums of sent and received."""
+        idle = True
+        sent = received = 0
+        for i in range(self.workers):
+            idle = idle and self.idle[i] == 1  # 每个worker先读idle再读计数
+            sent += self.sent[i]
+            received += self.received[i]
+        return idle, sent, received
+
+
+class Worker(object):
+    """
+      Owns the states whose zobrist hash is index modulo the worker count:
+      their open list, best g and the link back to their parent.
+    """
+
+    def __init__(self, index, problem, heuristic, shared, start):
+        self.index = index
+        self.problem = problem
+        self.heuristic = heuristic
+        self.shared = shared
+        self.start = start
+        self.open = []  # (f, h, count, record, g)
+        self.g = {}  # 编码后的状态 -> 最好的g
+        self.links = {}  # 编码后的状态 -> (父状态, 推箱子的动作)
+        self.count = 0
+        self.outboxes = [[] for _ in range(shared.workers)]
+
+    def run(self, conn):
+        problem = self.problem
+        shared = self.shared
+        start = problem.decodeState(self.start)
+        if start.zhash % shared.workers == self.index:
+            self._offer(self.start, 0, self.heuristic(start, problem), None, None)
+
+        while not shared.done.value:
+            self._receive()
+            if self._expand():
+                shared.idle[self.index] = 0
+                continue
+            self._flush(True)
+            if any(self.outboxes):
+                continue
+            shared.idle[self.index] = 1
+            time.sleep(0.0005)
+
+        self._answer(conn)
+
+    def _receive(self):
+        shared = self.shared
+        me = self.index
+        for j in range(shared.workers):
+            ring = shared.rings[j][me]
+            if ring is None or not ring.has_data():
+                continue
+            shared.idle[me] = 0  # 先清idle再计数，协调者不会看到"空闲但刚收到消息"
+            messages = ring.get()
+            shared.received[me] += len(messages)
+            unpack = shared.message.unpack
+            for message in messages:
+                record, parent, g, h, cell, action = unpack(message)
+                self._offer(record, g, h, parent, (cell, ACTION_CHARS[action]))
+
+    def _offer(self, record, g, h, parent, push):
+        old = self.g.get(record)
+        if old is not None and old <= g:
+            return
+        if g + h >= self.shared.incumbent.value:
+            return
+        self.g[record] = g
+        self.links[record] = (parent, push)
+        self.count += 1
+        heapq.heappush(self.open, (g + h, h, self.count, record, g))
+
+    def _expand(self):
+        """Expand up to EXPAND_BATCH states below the incumbent, False if there were none."""
+        problem = self.problem
+        shared = self.shared
+        workers = shared.workers
+        pack = shared.message.pack
+        expanded = False
+        for _ in range(EXPAND_BATCH):
+            if max([len(outbox) for outbox in self.outboxes]) >= BACKLOG:
+                break  # 对方收得慢，等它们
+            node = self._pop()
+            if node is None:
+                break
+            expanded = True
+            record, g = node
+            state = problem.decodeState(record)
+            if problem.isGoalState(state):
+                with shared.lock:
+                    if g < shared.incumbent.value:
+                        shared.incumbent.value = g
+                        shared.goal[:] = record
+                continue
+
+            shared.expanded[self.index] += 1
+            for nxt, (cell, action), stepCost in problem.getSuccessors(state):
+                nextG = g + stepCost
+                h = self.heuristic(nxt, problem)
+                if nextG + h >= shared.incumbent.value:
+                    continue
+                nextRecord = problem.encodeState(nxt)
+                owner = nxt.zhash % workers
+                if owner == self.index:
+                    self._offer(nextRecord, nextG, h, record, (cell, action))
+                else:
+                    self.outboxes[owner].append(pack(nextRecord, record, nextG, h, cell, ACTION_CHARS.index(action)))
+            self._flush(False)
+        shared.frontier[self.index] = len(self.open)
+        return expanded
+
+    def _pop(self):
+        incumbent = self.shared.incumbent.value
+        while self.open:
+            f, h, _, record, g = self.open[0]
+            if f >= incumbent:
+                self.open = []  # 剩下的都不可能更好
+                return None
+            heapq.heappop(self.open)
+            if self.g.get(record) == g:
+                return record, g
+        return None
+
+    def _flush(self, force):
+        shared = self.shared
+        for owner, outbox in enumerate(self.outboxes):
+            if outbox and (force or len(outbox) >= BATCH):
+                ring = shared.rings[self.index][owner]
+                n = min(ring.room(), len(outbox))
+                if n:
+                    # 先计数再写进环，接收方数到的消息发送方一定已经数过
+                    shared.sent[self.index] += n
+                    ring.put(outbox[:n])
+                    del outbox[:n]  # 环满了，剩下的下次再发
+
+    def _answer(self, conn):
+        # 搜索结束后回答协调者的查询: 状态 -> (父状态, 推箱子的动作)
+        while True:
+            record = conn.recv()
+            if record is None:
+                return
+            conn.send(self.links.get(record))
+
+
+def _work(index, problem, heuristic, shared, start, conn):
+    profiler = getattr(problem, 'profiler', None)
+    if profiler is not None:
+        profiler.restart()
+    Worker(index, problem, heuristic, shared, start).run(conn)
+    if profiler is not None:
+        conn.send(profiler.export())  # 协调者把各个worker的统计合并起来
+
+
+def parallelAStarSearch(problem, heuristic=search.nullHeuristic, progress=search.nullProgress, workers=None):
+    """
+      HDA*: A* spread over worker processes by state hash. Every state has
+      one owner, zhash % workers, which keeps its open list entry, its best g
+      and its parent link. Successors of other owners are batched and sent
+      through a shared memory RingBuffer per worker pair, together with the
+      h computed by the sender. There are workers squared rings, so they
+      share RING_BUDGET bytes between them.
+
+      A goal only sets the shared incumbent, and every worker drops states
+      with f not below it. Termination is found with Mattern's four counter
+      method: the coordinator sums the sent and received counters of all
+      workers in waves, and stops when two waves in a row see every worker
+      idle and the first wave's received equals the second wave's sent.
+      This holds because a message is counted as sent before it can be
+      received, the counters only grow, and an idle worker only becomes
+      busy by receiving. No message is then in flight and no state with a
+      smaller f is left, so the incumbent is optimal. Like RingBuffer it
+      relies on each process's shared memory writes being seen in the order
+      they were made. The path is rebuilt by asking the owner of
+      each state for its parent. States must be hashable by zhash and
+      successors' actions (box_cell, action) pushes; needs the fork start
+      method.
+
+      Returns (actions, explored).
+    """
+    if heuristic is None:
+        heuristic = search.nullHeuristic
+    if progress is None:
+        progress = search.nullProgress
+    workers = workers or multiprocessing.cpu_count()
+
+    ctx = multiprocessing.get_context('fork')
+    start = problem.encodeState(problem.getStartState())
+    shared = Shared(ctx, workers, len(start))
+    pipes = [ctx.Pipe() for _ in range(workers)]
+    processes = [ctx.Process(target=_work, args=(i, problem, heuristic, shared, start, pipes[i][1]), daemon=True)
+                 for i in range(workers)]
+    for p in processes:
+        p.start()
+
+    explored = search.ExploredCounter()
+    frontier = search.ExploredCounter()
+    try:
+        last = None
+        while True:
+            time.sleep(0.01)
+            explored.count = sum(shared.expanded)
+            frontier.count = sum(shared.frontier)
+            progress(explored, frontier)
+            for p in processes:
+                if not p.is_alive():
+                    raise Exception("worker {0} exited with {1}".format(p.pid, p.exitcode))
+
+            wave = shared.wave()
+            idle, sent, _ = wave
+            if idle and last is not None and last[0] and last[2] == sent:
+                break
+            last = wave
+
+        shared.done.value = 1
+        actions = []
+        if shared.incumbent.value != INF:
+            actions = _rebuild(problem, shared, pipes, bytes(shared.goal))
+        for conn, _ in pipes:
+            conn.send(None)
+        profiler = getattr(problem, 'profiler', None)
+        if profiler is not None:
+            for conn, _ in pipes:
+                profiler.merge(*conn.recv())
+        for p in processes:
+            p.join()
+        explored.count = sum(shared.expanded)
+        return actions, explored
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+
+def _rebuild(problem, shared, pipes, record):
+    actions = []
+    while True:
+        owner = problem.decodeState(record).zhash % shared.workers
+        conn = pipes[owner][0]
+        conn.send(record)
+        parent, push = conn.recv()
+        if parent is None:
+            break
+        actions.append(push)
+        record = parent
+    actions.reverse()
+    return actions
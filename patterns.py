@@ -0,0 +1,170 @@
+import os
+import itertools
+
+import board as board_module
+
+
+class Window(object):
+    """A square window of the board, mask has the bits of its floor cells."""
+    __slots__ = ('cells', 'mask', 'patterns', 'memo')
+
+    def __init__(self, cells):
+        self.cells = cells
+        self.mask = 0
+        for c in cells:
+            self.mask |= 1 << c
+        self.patterns = []  # 完全落在窗口里的pattern
+        self.memo = {}  # 窗口里的箱子bitmask -> 是否死锁
+
+
+class PatternDatabase(object):
+    """
+      Dead box configurations of one static layout. A pattern is a bitmask of
+      box cells that can never all reach destinations, whatever the other
+      boxes and the man do, so any state whose boxes cover a pattern is dead.
+
+      A probe looks at the 3x3 window centred on the pushed box and the four
+      4x4 windows that have it in their middle 2x2. The boxes inside a window
+      (boxes & window.mask) are the key into that window's memo table, so a
+      probe is one mask and one dict lookup. A key not seen yet is checked
+      against the window's patterns and a freeze test on the window's boxes
+      alone. The database is seeded with the minimal freeze patterns of
+      every 3x3 window. Patterns proven by the corral sub-search are learned
+      at runtime, and when a store is given all patterns are saved per
+      static layout, so later runs start warm.
+    """
+
+    def __init__(self, board, freeze, corral, store=None, seed_boxes=3):
+        self.board = board
+        self.freeze = freeze  # pruning.FreezeDetector
+        self.corral = corral  # pruning.CorralDetector，用它的子搜索证明新的pattern
+        self.path = store.patterns_path(freeze.deadlock.layout) if store is not None else None
+
+        self.windows = {}
+        self.cell_windows = [self._windows_of(c) for c in range(board.cell_cnt)]
+        self.cell_patterns = [[] for _ in range(board.cell_cnt)]  # 放不进窗口的pattern
+        self.patterns = set()
+        self.learned = 0
+
+        if self.path and os.path.exists(self.path):
+            self._load()
+        else:
+            self._seed(seed_boxes)
+            self._save()
+
+    def _window(self, x0, y0, size):
+        key = (x0, y0, size)
+        window = self.windows.get(key)
+        if window is None:
+            cells = [self.board.cell_id(x, y) for y in range(y0, y0 + size) for x in range(x0, x0 + size)]
+            window = Window([c for c in cells if c >= 0])
+            self.windows[key] = window
+        return window
+
+    def _windows_of(self, cell):
+        x, y = self.board.cell_to_pos[cell]
+        windows = [self._window(x - 1, y - 1, 3)]
+        for x0 in (x - 2, x - 1):
+            for y0 in (y - 2, y - 1):
+                windows.append(self._window(x0, y0, 4))
+        return windows
+
+    def is_dead(self, boxes, box):
+        for window in self.cell_windows[box]:
+            key = boxes & window.mask
+            dead = window.memo.get(key)
+            if dead is None:
+                dead = self._evaluate(window, key)
+                window.memo[key] = dead
+            if dead:
+                return True
+        for pattern in self.cell_patterns[box]:
+            if boxes & pattern == pattern:
+                return True
+        return False
+
+    def _evaluate(self, window, key):
+        for pattern in window.patterns:
+            if key & pattern == pattern:
+                return True
+        return self._frozen(key)
+
+    def add(self, pattern):
+        if pattern in self.patterns:
+            return False
+        self.patterns.add(pattern)
+        placed = False
+        for window in self.windows.values():
+            if pattern & ~window.mask == 0:
+                window.patterns.append(pattern)
+                window.memo.clear()
+                placed = True
+        if not placed:
+            for c in self.board.cells_of(pattern):
+                self.cell_patterns[c].append(pattern)
+        return True
+
+    def learn(self, boxes):
+        """
+          boxes was proven dead with the man in one region. It becomes a
+          pattern only if the sub-search also fails from every other region
+          the man could be in.
+        """
+        if boxes in self.patterns:
+            return
+        bd = self.board
+        seen = bytearray(bd.cell_cnt)
+        for c in range(bd.cell_cnt):
+            if seen[c] or (boxes >> c) & 1:
+                continue
+            cells, _ = bd.reach(boxes, c)
+            for r in cells:
+                seen[r] = 1
+            if not self.corral.unsolvable(board_module.CompactState(bd, boxes, min(cells))):
+                return
+        if self.add(boxes):
+            self.learned += 1
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write('{0:x}\n'.format(boxes))
+
+    def _seed(self, seed_boxes):
+        # 3x3窗口里包含中心箱子的最多seed_boxes个箱子的组合，只记最小的
+        dest_mask = self.board.dest_mask
+        for center in range(self.board.cell_cnt):
+            others = [c for c in self.cell_windows[center][0].cells if c != center]
+            found = []
+            for n in range(seed_boxes):
+                for combo in itertools.combinations(others, n):
+                    pattern = 1 << center
+                    for c in combo:
+                        pattern |= 1 << c
+                    if pattern & ~dest_mask == 0 or any([pattern & f == f for f in found]):
+                        continue
+                    if self._frozen(pattern):
+                        found.append(pattern)
+            for pattern in found:
+                self.add(pattern)
+
+    def _frozen(self, boxes):
+        for c in self.board.cells_of(boxes & ~self.board.dest_mask):
+            if self.freeze.is_dead(boxes, c):
+                return True
+        return False
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    self.add(int(line, 16))
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp{0}'.format(os.getpid())
+        with open(tmp, 'w') as f:
+            for pattern in sorted(self.patterns):
+                f.write('{0:x}\n'.format(pattern))
+        os.replace(tmp, self.path)
@@ -0,0 +1,191 @@
+import os
+import time
+import signal
+import threading
+
+ENV = 'SOKOBAN_PROFILE'  # 设了这个环境变量才打开
+DEFAULT_DIR = os.environ.get('SOKOBAN_PROFILE_DIR', 'profiles')
+SAMPLE_INTERVAL = float(os.environ.get('SOKOBAN_PROFILE_INTERVAL', '0.001'))  # 采样间隔，CPU秒
+MAX_DEPTH = 64
+
+
+def from_env(name='search'):
+    """
+      A PhaseProfiler when the SOKOBAN_PROFILE environment variable is set,
+      else None. name may be a function returning the name, so a name that
+      is costly to build is only built when profiling.
+    """
+    if not os.environ.get(ENV):
+        return None
+    return PhaseProfiler(name() if callable(name) else name)
+
+
+class Phase(object):
+    """A node of the phase tree: time spent inside this phase under its parents, and inside its children."""
+    __slots__ = ('name', 'children', 'calls', 'total', 'inner')
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+        self.calls = 0
+        self.total = 0.0
+        self.inner = 0.0  # 花在子阶段里的时间
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = Phase(name)
+        return node
+
+
+class PhaseProfiler(object):
+    """
+      Time and call counts per search phase. patch replaces a method with a
+      timed wrapper for as long as the profiler runs; nested phases are kept
+      as a tree, so the time of deadlock checks inside successor generation
+      is not counted twice. Nothing is patched while the profiler is off, so
+      then it costs nothing.
+
+      While running it also samples the Python stack every interval seconds
+      of CPU time (SIGPROF, where available) for a flame graph. report gives
+      the summary per phase; save writes the samples as folded stacks, one
+      'a;b;c count' line per stack, the input of flamegraph.pl and speedscope.
+      A forked worker calls restart and sends export back to be merged, so
+      the time of all processes is summed.
+    """
+
+    def __init__(self, name='search', directory=None, interval=SAMPLE_INTERVAL):
+        self.name = name  # 存的文件名用
+        self.directory = directory or DEFAULT_DIR
+        self.interval = interval
+        self.root = Phase('search')
+        self.stack = [self.root]
+        self.patched = []  # (对象, 属性, 原来的值, 是不是对象自己的属性)
+        self.samples = {}  # 折叠后的调用栈 -> 采样次数
+        self.startTime = None
+        self.oldHandler = None
+
+    def wrap(self, name, func):
+        stack = self.stack
+        clock = time.perf_counter
+
+        def timed(*args):
+            parent = stack[-1]
+            node = parent.children.get(name) or parent.child(name)
+            stack.append(node)
+            t = clock()
+            try:
+                return func(*args)
+            finally:
+                dt = clock() - t
+                stack.pop()
+                node.calls += 1
+                node.total += dt
+                parent.inner += dt
+        return timed
+
+    def patch(self, obj, attr, name):
+        """Time every call of obj.attr as phase name until stop."""
+        original = getattr(obj, attr)
+        own = attr in vars(obj)
+        if isinstance(obj, type):
+            original = vars(obj)[attr]  # 类上的是函数，不是绑定的方法
+        self.patched.append((obj, attr, original, own))
+        setattr(obj, attr, self.wrap(name, original))
+
+    def start(self):
+        self.startTime = time.perf_counter()
+        if self.interval and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+            self.oldHandler = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        if self.oldHandler is not None:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self.oldHandler)
+            self.oldHandler = None
+        for obj, attr, original, own in reversed(self.patched):
+            if own:
+                setattr(obj, attr, original)
+            else:
+                delattr(obj, attr)
+        self.patched = []
+        self.root.calls += 1
+        self.root.total += time.perf_counter() - self.startTime
+
+    def restart(self):
+        """Start over in a forked child: the patches stay, the times and samples of the parent are dropped."""
+        self.root = Phase('search')
+        self.stack[:] = [self.root]  # 包装函数引用的是这个list，不能换成新的
+        self.samples = {}
+        self.oldHandler = None
+        self.start()  # 子进程不继承计时器，重新开始采样
+
+    def export(self):
+        """(phase tree, samples) of a child started with restart, to merge into the parent's profiler."""
+        if self.oldHandler is not None:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        self.root.calls += 1
+        self.root.total += time.perf_counter() - self.startTime
+        return self.root, self.samples
+
+    def merge(self, root, samples):
+        """Add the phases and samples of another process, so its time counts as well."""
+        def add(node, other):
+            node.calls += other.calls
+            node.total += other.total
+            node.inner += other.inner
+            for name, child in other.children.items():
+                add(node.child(name), child)
+        add(self.root, root)
+        for stack, count in samples.items():
+            self.samples[stack] = self.samples.get(stack, 0) + count
+
+    def _sample(self, signum, frame):
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            if code.co_filename != __file__:  # 跳过计时的包装函数
+                names.append("{0}.{1}".format(os.path.splitext(os.path.basename(code.co_filename))[0], code.co_name))
+            frame = frame.f_back
+        names.reverse()
+        key = ";".join(names)
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+    def summary(self):
+        """{phase: (calls, total seconds, self seconds)}, phases that appear at several places are summed."""
+        phases = {}
+
+        def walk(node, nested):
+            calls, total, own = phases.get(node.name, (0, 0.0, 0.0))
+            if node.name not in nested:  # 嵌套在同名阶段里的，外层已经算过
+                total += node.total
+            phases[node.name] = (calls + node.calls, total, own + node.total - node.inner)
+            for child in node.children.values():
+                walk(child, nested | {node.name})
+        walk(self.root, frozenset())
+        return phases
+
+    def report(self):
+        phases = self.summary()
+        whole = self.root.total or 1.0
+        lines = ["{0:<12} {1:>10} {2:>9} {3:>9} {4:>6} {5:>9}".format('phase', 'calls', 'total s', 'self s', '%',
+                                                                      'us/call')]
+        for name, (calls, total, own) in sorted(phases.items(), key=lambda p: -p[1][2]):
+            lines.append("{0:<12} {1:>10} {2:>9.3f} {3:>9.3f} {4:>6.1f} {5:>9.2f}".format(
+                name, calls, total, own, own * 100 / whole, total * 1e6 / calls if calls else 0))
+        return "\n".join(lines)
+
+    def folded(self):
+        return ["{0} {1}".format(stack, count) for stack, count in sorted(self.samples.items())]
+
+    def save(self, path=None):
+        """Write the folded stacks, returns the path or None when there were no samples."""
+        if not self.samples:
+            return None
+        if path is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, "{0}_{1}.folded".format(self.name, os.getpid()))
+        with open(path, 'w') as f:
+            f.write("\n".join(self.folded()) + "\n")
+        return path
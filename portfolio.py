@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import traceback
+import multiprocessing
+
+try:
+    import fcntl
+except ImportError:  # windows没有flock，同时保存时可能丢掉别的进程的记录
+    fcntl = None
+
+import space
+import solver
+import pruning
+import tablestore
+import telemetry
+
+PORTFOLIO = 'portfolio'  # 游戏和批量求解器里和solver的算法常量并列使用
+DEFAULT_HISTORY = os.environ.get('SOKOBAN_PORTFOLIO', 'portfolio.json')
+
+
+class Config(object):
+    """One member of the portfolio: an algorithm, a heuristic weight and the deadlock detectors to use."""
+
+    def __init__(self, name, algorithm, weight=1, detectors=pruning.DEFAULT_DETECTORS):
+        self.name = name
+        self.algorithm = algorithm
+        self.weight = weight
+        self.detectors = detectors
+
+    def problem(self, startState, progress=None, store=None):
+        return solver.SokobanSearchProblem(startState, progress, algorithm=self.algorithm, store=store,
+                                           detectors=self.detectors, weight=self.weight)
+
+
+DEFAULT_CONFIGS = [
+    Config('astar_deadlock', solver.ASTAR_DEADLOCK),
+    Config('astar_push', solver.ASTAR_PUSH),
+    Config('bidirectional', solver.BIDIRECTIONAL),
+    Config('astar_push_w2', solver.ASTAR_PUSH, weight=2),
+    Config('astar_deadlock_w2_light', solver.ASTAR_DEADLOCK, weight=2, detectors=('area', 'freeze')),
+    Config('astar', solver.ASTAR),
+    Config('bfs', solver.BFS),
+]
+
+
+class History(object):
+    """
+      Which configuration won on which level, in a JSON file. Levels are keyed
+      by tablestore.layout_key, so every state of a level shares its record.
+      record merges the win into the file under a lock, so processes racing
+      other levels at the same time do not overwrite each other's wins.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_HISTORY
+        self.wins = {}  # 配置 -> 赢的次数
+        self.levels = {}  # layout_key -> {配置: 赢的次数}
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.wins = data.get('wins', {})
+            self.levels = data.get('levels', {})
+
+    def order(self, configs, key):
+        """configs sorted by wins on this level, then by wins on all levels."""
+        level = self.levels.get(key, {})
+        ranked = sorted(enumerate(configs), key=lambda ic: (-level.get(ic[1].name, 0),
+                                                             -self.wins.get(ic[1].name, 0), ic[0]))
+        return [c for _, c in ranked]
+
+    def record(self, key, name):
+        # 文件会被os.replace换掉，所以锁在旁边一个不动的文件上
+        with open(self.path + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            self.load()  # 别的进程在这之前存的记录
+            self.wins[name] = self.wins.get(name, 0) + 1
+            level = self.levels.setdefault(key, {})
+            level[name] = level.get(name, 0) + 1
+            self.save()
+
+    def save(self):
+        tmp = self.path + '.tmp{0}'.format(os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'wins': self.wins, 'levels': self.levels}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def _run(index, config, startState, queue, counters):
+    start = time.time()
+    try:
+        problem = config.problem(startState, store=tablestore.TableStore())
+        problem.progress = counters.reporter(index, problem)
+        actions, exploredSet = problem.solve()
+        problem.progress.finish(len(exploredSet))
+    except Exception:
+        # 出错也要发结果，不然poll一直等这个配置
+        traceback.print_exc()
+        queue.put([1, (index, [], 0, time.time() - start)])
+        return
+    queue.put([1, (index, list(actions), len(exploredSet), time.time() - start)])
+
+
+def is_solution(startState, actions):
+    state = startState
+    for action in actions:
+        state = state.try_move(*space.ACTIONS[action])
+        if state is None:
+            return False
+    return state.is_finished()
+
+
+class PortfolioSolver(object):
+    """
+      Races several Configs on one level, each in its own process. The first
+      valid solution wins. With a grace window, the shortest solution found
+      within grace seconds of the first one wins instead. The other
+      processes are then terminated and the winner is recorded in the
+      History, which decides the order, and so which configs run when size
+      is smaller than the portfolio, next time. log, if given, is called
+      with a line of text for every config that finishes.
+
+      Same interface as sokoban_game.ConcurrentSolver: start, poll and end.
+      poll returns [0, (explored, frontier)] of the config furthest ahead,
+      read from a telemetry.Telemetry slot per config, or
+      [1, (actions, explored)] once decided.
+    """
+
+    def __init__(self, startState, configs=None, size=None, grace=0.0, history=None, log=None):
+        self.startState = startState
+        self.key = tablestore.layout_key(startState.layout)
+        self.history = history or History()
+        configs = self.history.order(configs or DEFAULT_CONFIGS, self.key)
+        self.configs = configs[:size or multiprocessing.cpu_count()]
+        self.grace = grace
+        self.log = log
+
+        self.queue = multiprocessing.Queue()  # 只发结果，进度走共享内存
+        self.telemetry = telemetry.Telemetry(len(self.configs))
+        self.processes = [multiprocessing.Process(target=_run, args=(i, c, startState, self.queue, self.telemetry),
+                                                  daemon=True)
+                          for i, c in enumerate(self.configs)]
+        self.explored = 0  # 上次poll报出去的展开数
+        self.finished = set()
+        self.best = None  # (actions, explored, config index)
+        self.first_time = None
+        self.decided = False
+
+    def start(self):
+        for p in self.processes:
+            p.start()
+
+    def end(self):
+        for p in self.processes:
+            if p.is_alive():
+                p.terminate()
+        for p in self.processes:
+            if p.pid is not None:
+                p.join(1)
+
+    def poll(self):
+        if self.decided:
+            return None
+        # 先看谁已经退出，再收结果：退出前发的结果这时一定收得到
+        exited = [i for i, p in enumerate(self.processes) if p.exitcode is not None]
+        while True:
+            try:
+                typ, info = self.queue.get_nowait()
+            except Exception:
+                break
+            self._result(*info)
+        for index in exited:
+            if index not in self.finished:
+                # 被杀掉或崩溃了，没发结果，当作失败
+                self.finished.add(index)
+                if self.log:
+                    self.log("portfolio {0}: died with exit code {1}".format(
+                        self.configs[index].name, self.processes[index].exitcode))
+
+        if self._is_decided():
+            return self._decide()
+        sample = max(self.telemetry.samples(), key=lambda s: s.expanded)
+        if sample.expanded == self.explored:
+            return None
+        self.explored = sample.expanded
+        return [0, (sample.expanded, sample.frontier)]
+
+    def _result(self, index, actions, explored, seconds):
+        self.finished.add(index)
+        config = self.configs[index]
+        if not actions or not is_solution(self.startState, actions):
+            if self.log:
+                self.log("portfolio {0}: no solution in {1:.1f}s".format(config.name, seconds))
+            return
+        if self.log:
+            self.log("portfolio {0}: {1} steps in {2:.1f}s".format(config.name, len(actions), seconds))
+        if self.first_time is None:
+            self.first_time = time.time()
+        if self.best is None or len(actions) < len(self.best[0]):
+            self.best = (actions, explored, index)
+
+    def _is_decided(self):
+        if len(self.finished) == len(self.processes):
+            return True
+        return self.first_time is not None and time.time() - self.first_time >= self.grace
+
+    def _decide(self):
+        self.decided = True
+        self.end()
+        if self.best is None:
+            return [1, ([], 0)]
+        actions, explored, index = self.best
+        self.history.record(self.key, self.configs[index].name)
+        return [1, (actions, explored)]
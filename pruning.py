@@ -0,0 +1,297 @@
+import time
+
+import space
+import patterns
+
+HORIZONTAL = 0
+VERTICAL = 1
+
+
+class Detector(object):
+    """
+      One deadlock check run after every push. check(state, box) gets the
+      state after the push and the cell id the box was pushed to, and returns
+      True when the state can never be solved. Each detector counts its own
+      calls, pruned states and time.
+    """
+    name = ''
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.board = problem.board
+        self.deadlock = problem.deadlock
+        self.calls = 0
+        self.pruned = 0
+        self.seconds = 0.0
+
+    def check(self, state, box):
+        raise NotImplementedError
+
+
+class AreaDetector(Detector):
+    """箱子推到了到不了目的地的格子，或者一个area里的箱子比它能到的目的地多"""
+    name = 'area'
+
+    def __init__(self, problem):
+        super().__init__(problem)
+        self.area_masks = {}
+
+    def _mask(self, area):
+        mask = self.area_masks.get(id(area))
+        if mask is None:
+            mask = 0
+            for x, y in area.positions:
+                mask |= 1 << self.board.cell_id(x, y)
+            self.area_masks[id(area)] = mask
+        return mask
+
+    def check(self, state, box):
+        area = self.deadlock.spaceid_to_area[box]
+        if area.reachable_dest_count == 0:
+            return True
+        return bin(state.boxes & self._mask(area)).count('1') > area.reachable_dest_count
+
+
+class QuadDetector(Detector):
+    """2x2的4个格子都是墙或箱子，又有不在目的地上的箱子"""
+    name = 'quad'
+
+    def __init__(self, problem):
+        super().__init__(problem)
+        bd = self.board
+        diagonals = [(-1, -1), (1, 1), (-1, 1), (1, -1)]
+        self.quads = []
+        for bx, by in bd.cell_to_pos:
+            self.quads.append([[bd.cell_id(x, y) for x, y in [(bx + dx, by), (bx + dx, by + dy), (bx, by + dy)]]
+                               for dx, dy in diagonals])
+
+    def check(self, state, box):
+        boxes = state.boxes
+        dest_mask = self.board.dest_mask
+        for quad in self.quads[box]:
+            has_box_not_at_dest = (dest_mask >> box) & 1 == 0
+            for c in quad:
+                if c < 0:
+                    continue
+                if not (boxes >> c) & 1:
+                    break
+                if not (dest_mask >> c) & 1:
+                    has_box_not_at_dest = True
+            else:
+                if has_box_not_at_dest:
+                    return True
+        return False
+
+
+class FreezeDetector(Detector):
+    """
+      Freeze deadlock: the pushed box can move along neither axis, because of
+      walls, dead squares on both sides, or boxes that are frozen themselves,
+      and one of the frozen boxes is not on a destination.
+    """
+    name = 'freeze'
+
+    def __init__(self, problem):
+        super().__init__(problem)
+        nb = self.board.neighbors
+        self.axes = [(nb[space.ACTIONS['l']], nb[space.ACTIONS['r']]),
+                     (nb[space.ACTIONS['d']], nb[space.ACTIONS['u']])]
+
+    def check(self, state, box):
+        return self.is_dead(state.boxes, box)
+
+    def is_dead(self, boxes, box):
+        frozen = []
+        if not self._frozen(box, boxes, set(), frozen):
+            return False
+        dest_mask = self.board.dest_mask
+        for c in frozen:
+            if not (dest_mask >> c) & 1:
+                return True
+        return False
+
+    def _frozen(self, cell, boxes, walls, frozen):
+        # 判断别的箱子时，当前箱子当作墙，避免循环
+        mark = len(frozen)
+        walls.add(cell)
+        result = self._blocked(cell, HORIZONTAL, boxes, walls, frozen) and \
+            self._blocked(cell, VERTICAL, boxes, walls, frozen)
+        walls.discard(cell)
+        if result:
+            frozen.append(cell)
+        else:
+            del frozen[mark:]
+        return result
+
+    def _blocked(self, cell, axis, boxes, walls, frozen):
+        back, forward = self.axes[axis]
+        a = back[cell]
+        b = forward[cell]
+        if a < 0 or b < 0 or a in walls or b in walls:
+            return True
+        dead_mask = self.deadlock.dead_mask
+        if (dead_mask >> a) & 1 and (dead_mask >> b) & 1:
+            return True
+        for n in (a, b):
+            if (boxes >> n) & 1 and self._frozen(n, boxes, walls, frozen):
+                return True
+        return False
+
+
+class CorralDetector(Detector):
+    """
+      PI-corral deadlock. The man cannot reach the area next to the pushed
+      box, and every push of the boxes around it would go into that area. A
+      bounded push-level sub-search is then run with only those boxes on the
+      board. Removing boxes only makes the level easier, so if the sub-search
+      runs out of states before all of those boxes are on destinations, the
+      state is dead. If the sub-search hits max_nodes, nothing is proven.
+    """
+    name = 'corral'
+
+    def __init__(self, problem, max_boxes=6, max_nodes=50):
+        super().__init__(problem)
+        self.max_boxes = max_boxes
+        self.max_nodes = max_nodes
+        self.results = {}  # (箱子, 人的区域) -> 是否死锁
+        self.on_proven = None  # 证明了死锁时用这些箱子回调，见patterns.PatternDatabase.learn
+
+    def check(self, state, box):
+        bd = self.board
+        boxes = state.boxes
+        _, seen = bd.reach(boxes, state.man)
+
+        corral, corral_boxes = self._corral(boxes, seen, box)
+        if not corral or corral_boxes & ~bd.dest_mask == 0:
+            return False
+        if bin(corral_boxes).count('1') > self.max_boxes:
+            return False
+        if not self._is_pi(boxes, seen, corral, corral_boxes):
+            return False
+
+        start = bd.normalize(corral_boxes, state.man)
+        key = (corral_boxes, start.man)
+        dead = self.results.get(key)
+        if dead is None:
+            dead = self.unsolvable(start)
+            self.results[key] = dead
+            if dead and self.on_proven:
+                self.on_proven(corral_boxes)
+        return dead
+
+    def _corral(self, boxes, seen, box):
+        # 推过去的箱子旁边人到不了的空地连成的区域，和挨着这个区域的箱子
+        bd = self.board
+        corral = 0
+        stack = []
+        for _, step, _ in bd.action_steps:
+            n = step[box]
+            if n >= 0 and not seen[n] and not (boxes >> n) & 1 and not (corral >> n) & 1:
+                corral |= 1 << n
+                stack.append(n)
+        corral_boxes = 1 << box
+        while stack:
+            c = stack.pop()
+            for _, step, _ in bd.action_steps:
+                n = step[c]
+                if n < 0 or (corral >> n) & 1 or seen[n]:
+                    continue
+                if (boxes >> n) & 1:
+                    corral_boxes |= 1 << n
+                else:
+                    corral |= 1 << n
+                    stack.append(n)
+        return corral, corral_boxes
+
+    def _is_pi(self, boxes, seen, corral, corral_boxes):
+        # I条件: 人从外面能做的推动，都是把箱子推进corral里
+        bd = self.board
+        for b in bd.cells_of(corral_boxes):
+            for _, step, back in bd.action_steps:
+                m = back[b]
+                n = step[b]
+                if m < 0 or not seen[m] or n < 0 or (boxes >> n) & 1:
+                    continue
+                if not (corral >> n) & 1:
+                    return False
+        return True
+
+    def unsolvable(self, start):
+        """True if the push-level search from start runs out before all boxes are on destinations."""
+        bd = self.board
+        dest_mask = bd.dest_mask
+        dead_mask = self.deadlock.dead_mask
+        visited = {start}
+        frontier = [start]
+        while frontier:
+            state = frontier.pop()
+            for nxt, _, (x, y) in bd.pushes(state):
+                if nxt in visited or (dead_mask >> bd.cell_id(x, y)) & 1:
+                    continue
+                if nxt.boxes & ~dest_mask == 0:
+                    return False
+                if len(visited) >= self.max_nodes:
+                    return False
+                visited.add(nxt)
+                frontier.append(nxt)
+        return True
+
+
+class PatternDetector(Detector):
+    """Looks the pushed box's neighbourhood up in a patterns.PatternDatabase."""
+    name = 'pattern'
+
+    def __init__(self, problem):
+        super().__init__(problem)
+        self.database = patterns.PatternDatabase(problem.board, FreezeDetector(problem), CorralDetector(problem),
+                                                 getattr(problem, 'store', None))
+
+    def check(self, state, box):
+        return self.database.is_dead(state.boxes, box)
+
+
+DETECTORS = {
+    'area': AreaDetector,
+    'quad': QuadDetector,
+    'pattern': PatternDetector,
+    'freeze': FreezeDetector,
+    'corral': CorralDetector,
+}
+
+DEFAULT_DETECTORS = ('area', 'pattern', 'freeze', 'corral')
+
+
+class Pruner(object):
+    """Runs the detectors in order after every push and keeps their counters."""
+
+    def __init__(self, problem, detectors=DEFAULT_DETECTORS):
+        self.detectors = [DETECTORS[name](problem) if isinstance(name, str) else name for name in detectors]
+
+        # corral证明的死锁存进pattern库
+        corral = self.get('corral')
+        pattern = self.get('pattern')
+        if corral and pattern:
+            corral.on_proven = pattern.database.learn
+
+    def is_deadlock(self, state, box):
+        for detector in self.detectors:
+            t = time.perf_counter()
+            dead = detector.check(state, box)
+            detector.seconds += time.perf_counter() - t
+            detector.calls += 1
+            if dead:
+                detector.pruned += 1
+                return True
+        return False
+
+    def get(self, name):
+        for detector in self.detectors:
+            if detector.name == name:
+                return detector
+        return None
+
+    def stats(self):
+        return {d.name: {'calls': d.calls, 'pruned': d.pruned, 'seconds': d.seconds} for d in self.detectors}
+
+    def report(self):
+        return " ".join(["{0}={1}/{2} {3:.2f}s".format(d.name, d.pruned, d.calls, d.seconds) for d in self.detectors])
@@ -0,0 +1,139 @@
+import os
+import math
+import json
+import time
+
+import board
+import space
+
+DEFAULT_HISTORY = os.environ.get('SOKOBAN_ATTEMPTS', 'attempts.json')
+
+SOLVED = 'solved'
+TIMEOUT = 'timeout'
+MEMORY = 'memory'
+FAILED = 'failed'  # 搜完了没有解，或者出错了；再给预算也没用，不再重试
+
+
+def difficulty(layout):
+    """
+      A cheap estimate of how hard a level is, in bits: the log2 of the ways
+      to place the boxes on the floor cells that are not dead corners. More
+      boxes and more floor make a level look harder. Only the layout is
+      needed, so every level is ranked on the same scale, whether or not its
+      deadlock tables are cached, and ranking never runs Deadlock.prepare.
+    """
+    n = 0
+    for line in layout:
+        for c in line:
+            if c == space.S_BOX or c == space.S_BOX_AT_DEST:
+                n += 1
+
+    bd = board.SokobanBoard(layout)
+    live = 0
+    for x, y in bd.cell_to_pos:
+        # 不是目的地的墙角，箱子推进去就出不来
+        corner = (bd.is_block(x - 1, y) or bd.is_block(x + 1, y)) and (bd.is_block(x, y - 1) or bd.is_block(x, y + 1))
+        if bd.is_dest(x, y) or not corner:
+            live += 1
+    return math.log2(math.comb(live, n)) if live >= n else 0.0
+
+
+class AttemptHistory(object):
+    """Every attempt on every level, with its budget and outcome, in a JSON file."""
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_HISTORY
+        self.attempts = {}  # 关卡 -> [{'round', 'timeout', 'memory', 'result', 'seconds', 'explored'}]
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.attempts = {int(level): attempts for level, attempts in json.load(f).items()}
+
+    def rounds(self, level):
+        """Rounds already spent on level without solving it."""
+        return len([a for a in self.attempts.get(level, []) if a['result'] != SOLVED])
+
+    def failed(self, level):
+        """Whether an attempt on level ended in FAILED."""
+        return any([a['result'] == FAILED for a in self.attempts.get(level, [])])
+
+    def add(self, level, **attempt):
+        self.attempts.setdefault(level, []).append(attempt)
+        self.save()
+
+    def save(self):
+        tmp = self.path + '.tmp{0}'.format(os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({str(level): attempts for level, attempts in sorted(self.attempts.items())}, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+class Job(object):
+    __slots__ = ('level', 'startState', 'difficulty', 'round', 'timeout', 'memory', 'startTime')
+
+    def __init__(self, level, startState, difficulty, round):
+        self.level = level
+        self.startState = startState
+        self.difficulty = difficulty
+        self.round = round
+        self.timeout = 0
+        self.memory = 0
+        self.startTime = 0
+
+
+class Scheduler(object):
+    """
+      Hands out unsolved levels easiest first. A level that runs out of
+      time or memory goes back into the queue one round up. Round r gets
+      timeout * timeout_factor ** r seconds and memory * memory_factor ** r
+      bytes (0 for no limit), so all levels get a cheap try before any level
+      gets an expensive one. Levels past max_rounds are dropped, and so are
+      FAILED ones, which a bigger budget would not help. Rounds are counted
+      from the history, so a new run continues where the last one stopped.
+    """
+
+    def __init__(self, levels, timeout=30, timeout_factor=2.0, memory=0, memory_factor=2.0, max_rounds=4,
+                 history=None):
+        self.timeout = timeout
+        self.timeout_factor = timeout_factor
+        self.memory = memory
+        self.memory_factor = memory_factor
+        self.max_rounds = max_rounds
+        self.history = history or AttemptHistory()
+
+        self.pending = []
+        for level, startState in levels:
+            job = Job(level, startState, difficulty(startState.layout), self.history.rounds(level))
+            if job.round < max_rounds and not self.history.failed(level):
+                self.pending.append(job)
+        self.dropped = len(levels) - len(self.pending)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def next(self):
+        """The pending Job with the lowest (round, difficulty), with its budget filled in, or None."""
+        if not self.pending:
+            return None
+        job = min(self.pending, key=lambda j: (j.round, j.difficulty))
+        self.pending.remove(job)
+        job.timeout = self.timeout * self.timeout_factor ** job.round
+        job.memory = int(self.memory * self.memory_factor ** job.round)
+        job.startTime = time.time()
+        return job
+
+    def done(self, job, result, explored=0):
+        """Record the outcome of job. Jobs out of time or memory are requeued for the next round."""
+        self.history.add(job.level, round=job.round, timeout=job.timeout, memory=job.memory, result=result,
+                         seconds=round(time.time() - job.startTime, 1), explored=explored)
+        if result == SOLVED:
+            return
+        job.round += 1
+        if result in (TIMEOUT, MEMORY) and job.round < self.max_rounds:
+            self.pending.append(job)
+        else:
+            self.dropped += 1
+
+
+def rank(levels):
+    """(level, startState) pairs sorted easiest first."""
+    return sorted(levels, key=lambda ls: difficulty(ls[1].layout))
@@ -1,3 +1,13 @@
+import os
+import sys
+import time
+import array
+import bisect
+import heapq
+import pickle
+import random
+import signal
+
 import util
 
 
@@ -19,18 +29,50 @@ class SearchProblem:
         """
         raise NotImplementedError
 
+    def encodeState(self, state):
+        """
+          Fixed width bytes for state, the same state always gives the same
+          bytes. Only needed by engines that keep encoded states, such as
+          levelSynchronousSearch.
+        """
+        raise NotImplementedError
+
+    def decodeState(self, data):
+        """The inverse of encodeState."""
+        raise NotImplementedError
+
+    def orderSuccessors(self, state, successors, parent=None):
+        """
+          The order in which depth first engines such as IDA* try the
+          successors of state. parent is the state before state, None at
+          the start.
+        """
+        return successors
+
 
 def nullProgress(_explored, _frontier):
     pass
 
 
+# A search node is [state, parent node, action from parent, ...]. Only the
+# last action is kept per node, the solution is rebuilt once from the goal.
+def rebuildSolution(node):
+    """Follow the parent references of node back to the start and return the actions."""
+    actions = []
+    while node[1] is not None:
+        actions.append(node[2])
+        node = node[1]
+    actions.reverse()
+    return actions
+
+
 def depthFirstSearch(problem, progress=nullProgress):
     if progress is None:
         progress = nullProgress
 
     frontier = util.Stack()
     state = problem.getStartState()
-    node = [state, []]
+    node = (state, None, None)
     frontier.push(node)
     exploredSet = set()
 
@@ -38,25 +80,29 @@ def depthFirstSearch(problem, progress=nullProgress):
         if frontier.isEmpty():
             return [], exploredSet
 
-        state, solution = frontier.pop()
+        node = frontier.pop()
+        state = node[0]
         if problem.isGoalState(state):
-            return solution, exploredSet
+            return rebuildSolution(node), exploredSet
         exploredSet.add(state)
         progress(exploredSet, frontier)
 
         for nextState, action, stepCost in problem.getSuccessors(state):
             if nextState not in exploredSet:
-                nextNode = [nextState, [*solution, action]]
-                frontier.push(nextNode)
+                frontier.push((nextState, node, action))
 
 
 def breadthFirstSearch(problem, progress=nullProgress):
+    """
+      Returns (actions, exploredDict), exploredDict maps every explored state
+      to its depth.
+    """
     if progress is None:
         progress = nullProgress
 
     frontier = util.Queue()
     state = problem.getStartState()
-    node = [state, []]
+    node = (state, None, None, 0)
     frontier.push(node)
     exploredSet = {}
 
@@ -64,48 +110,442 @@ def breadthFirstSearch(problem, progress=nullProgress):
         if frontier.isEmpty():
             return [], exploredSet
 
-        state, solution = frontier.pop()
+        node = frontier.pop()
+        state = node[0]
+        if state in exploredSet:
+            continue  # 同一个状态可能被多次加入frontier，第一次出队时深度最小
         if problem.isGoalState(state):
-            return solution, exploredSet
-        exploredSet[state] = solution
+            return rebuildSolution(node), exploredSet
+        depth = node[3]
+        exploredSet[state] = depth
         progress(exploredSet, frontier)
 
         for nextState, action, stepCost in problem.getSuccessors(state):
             if nextState not in exploredSet:
-                nextNode = [nextState, [*solution, action]]
-                frontier.push(nextNode)
+                frontier.push((nextState, node, action, depth + 1))
 
 
 def nullHeuristic(state, problem):
     return 0
 
 
-def aStarSearch(problem, heuristic=nullHeuristic, progress=nullProgress):
+class Layer:
+    """
+      One recent BFS layer: sorted, distinct, fixed width records packed into
+      a single bytes object, plus a set of the records for fast duplicate
+      checks while the layer is among the last few.
+    """
+
+    def __init__(self, records, width):
+        self.lookup = records if isinstance(records, set) else set(records)
+        records = sorted(self.lookup)
+        self.data = b''.join(records)
+        self.width = width
+        self.size = len(records)
+
+    def record(self, i):
+        w = self.width
+        return self.data[i * w:(i + 1) * w]
+
+    def nbytes(self):
+        return len(self.data) + sys.getsizeof(self.lookup) + self.size * sys.getsizeof(self.data[:self.width])
+
+    def __contains__(self, record):
+        return record in self.lookup
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.record(i)
+
+    def __len__(self):
+        return self.size
+
+
+DEPTH_BYTES = 2  # Run里每条记录后面的层号
+FENCE_EVERY = 32  # Run每隔这么多条记录在内存里留一个key，二分先在这些key里找
+
+
+class Run:
+    """
+      Older BFS layers first..last merged into one bytes object of records
+      sorted by state, each followed by its depth, so a duplicate check is one
+      binary search however many layers the run holds and a state costs its
+      width plus DEPTH_BYTES.
+    """
+
+    def __init__(self, data, width, first, last):
+        self.data = data
+        self.width = width
+        self.step = width + DEPTH_BYTES
+        self.size = len(data) // self.step
+        self.first = first
+        self.last = last
+        self.fences = [self.key(i) for i in range(0, self.size, FENCE_EVERY)]
+
+    @classmethod
+    def fromLayer(cls, layer, depth):
+        tag = depth.to_bytes(DEPTH_BYTES, 'big')
+        return cls(b''.join([record + tag for record in layer]), layer.width, depth, depth)
+
+    @classmethod
+    def merge(cls, older, newer):
+        return cls(b''.join(heapq.merge(older.entries(), newer.entries())), older.width, older.first, newer.last)
+
+    def key(self, i):
+        start = i * self.step
+        return self.data[start:start + self.width]
+
+    def entries(self):
+        step = self.step
+        for start in range(0, len(self.data), step):
+            yield self.data[start:start + step]
+
+    def records(self, depth):
+        """The records of layer depth."""
+        tag = depth.to_bytes(DEPTH_BYTES, 'big')
+        w = self.width
+        for entry in self.entries():
+            if entry[w:] == tag:
+                yield entry[:w]
+
+    def nbytes(self):
+        return len(self.data) + sys.getsizeof(self.fences) + len(self.fences) * sys.getsizeof(self.data[:self.width])
+
+    def __contains__(self, record):
+        block = bisect.bisect_right(self.fences, record) - 1
+        if block < 0:
+            return False
+        lo = block * FENCE_EVERY
+        hi = min(lo + FENCE_EVERY, self.size)
+        lo = bisect.bisect_left(range(self.size), record, lo, hi, key=self.key)
+        return lo < hi and self.key(lo) == record
+
+    def __iter__(self):
+        w = self.width
+        for entry in self.entries():
+            yield entry[:w], int.from_bytes(entry[w:], 'big')
+
+    def __len__(self):
+        return self.size
+
+
+class LayeredExplored:
+    """
+      The explored states of levelSynchronousSearch: the last few layers as
+      Layers, older ones merged into Runs whose sizes shrink geometrically
+      from oldest to newest, so there are only O(log n) of them.
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.recent = []  # 最近的几层，第depth - len(recent)层开始
+        self.runs = []
+        self.depth = 0  # 已经存了几层
+        self.count = 0  # expanded so far
+        self.truncated = False  # stopped at the memory ceiling
+
+    def add(self, layer, lookupLayers):
+        self.recent.append(layer)
+        self.depth += 1
+        if len(self.recent) > max(lookupLayers, 1):
+            self.runs.append(Run.fromLayer(self.recent.pop(0), self.depth - len(self.recent) - 1))
+            runs = self.runs
+            while len(runs) > 1 and runs[-2].size <= 2 * runs[-1].size:
+                newer = runs.pop()
+                runs[-1] = Run.merge(runs[-1], newer)
+
+    def since(self, depth):
+        """The Layers and Runs holding layers from depth on, newest first."""
+        stores = [layer for i, layer in enumerate(self.recent) if self.depth - len(self.recent) + i >= depth]
+        stores.reverse()
+        stores.extend([run for run in reversed(self.runs) if run.last >= depth])
+        return stores
+
+    def layer(self, depth):
+        """The records of layer depth."""
+        first = self.depth - len(self.recent)
+        if depth >= first:
+            return iter(self.recent[depth - first])
+        for run in self.runs:
+            if run.first <= depth <= run.last:
+                return run.records(depth)
+        return iter(())
+
+    def nbytes(self):
+        return sum([store.nbytes() for store in self.recent + self.runs])
+
+    def items(self):
+        """(state, depth) of every stored state."""
+        decode = self.problem.decodeState
+        for run in self.runs:
+            for record, depth in run:
+                yield decode(record), depth
+        first = self.depth - len(self.recent)
+        for i, layer in enumerate(self.recent):
+            for record in layer:
+                yield decode(record), first + i
+
+    def __len__(self):
+        return self.count
+
+
+def levelSynchronousSearch(problem, progress=nullProgress, maxBytes=None, dupLayers=None, lookupLayers=2):
+    """
+      Breadth first search one layer at a time on encoded states (see
+      SearchProblem.encodeState). Only the layers are stored, no nodes.
+      Duplicates are removed inside a layer and against the previous
+      dupLayers layers (all if None); fewer layers save time but may expand
+      a state again. Only the last lookupLayers layers keep a lookup set,
+      older ones are packed into sorted Runs. When the stored layers and the
+      layer being built would exceed maxBytes the search stops without a
+      solution and explored.truncated is set.
+
+      Returns (actions, explored), explored is a LayeredExplored.
+    """
+    if progress is None:
+        progress = nullProgress
+
+    encode = problem.encodeState
+    decode = problem.decodeState
+    start = encode(problem.getStartState())
+    width = len(start)
+    # 下一层还在set里时每条记录的开销: bytes对象本身加上打包后的那份
+    recordBytes = sys.getsizeof(start) + width
+    explored = LayeredExplored(problem)
+    layer = Layer([start], width)
+
+    while layer.size:
+        explored.add(layer, lookupLayers)
+        previous = explored.since(0 if dupLayers is None else explored.depth - dupLayers - 1)
+        stored = explored.nbytes()
+        nextRecords = set()
+        for record in layer:
+            state = decode(record)
+            if problem.isGoalState(state):
+                return _rebuildLayered(problem, explored, record), explored
+            explored.count += 1
+            progress(explored, layer)
+
+            for nextState, action, stepCost in problem.getSuccessors(state):
+                nextRecord = encode(nextState)
+                if nextRecord in nextRecords:
+                    continue
+                for old in previous:
+                    if nextRecord in old:
+                        break
+                else:
+                    nextRecords.add(nextRecord)
+                    if maxBytes is not None and len(nextRecords) & 1023 == 0 and \
+                            stored + sys.getsizeof(nextRecords) + len(nextRecords) * recordBytes > maxBytes:
+                        explored.truncated = True
+                        return [], explored
+
+        layer = Layer(nextRecords, width)
+        if maxBytes is not None and explored.nbytes() + layer.nbytes() > maxBytes:
+            explored.truncated = True
+            return [], explored
+
+    return [], explored
+
+
+def _rebuildLayered(problem, explored, record):
+    # Walk back from the goal layer, finding in each layer a state with a successor equal to record.
+    encode = problem.encodeState
+    actions = []
+    for depth in range(explored.depth - 2, -1, -1):
+        for parentRecord in explored.layer(depth):
+            for nextState, action, stepCost in problem.getSuccessors(problem.decodeState(parentRecord)):
+                if encode(nextState) == record:
+                    break
+            else:
+                continue
+            actions.append(action)
+            record = parentRecord
+            break
+    actions.reverse()
+    return actions
+
+
+class Checkpointer:
+    """
+      Saves a running search to path every interval seconds, and when signum
+      arrives, so a later run can resume from it. After a signal the search
+      is saved and then stopped with SystemExit; a signal that comes while
+      no search is running exits at once. The file is removed once the
+      search finishes. elapsed and resumes count the search time and the
+      runs before this one.
+
+      tag describes what the saved values depend on besides the start state,
+      such as the heuristic; a file saved under another tag is not resumed.
+      Only aStarSearch takes a checkpoint so far.
+    """
+
+    def __init__(self, path, interval=300, signum=None, tag=None):
+        self.path = path
+        self.interval = interval
+        self.tag = tag
+        self.requested = False
+        self.stop = False
+        self.running = False
+        self.startTime = time.time()
+        self.lastSave = self.startTime
+        self.elapsed = 0.0
+        self.resumes = 0
+        if signum is not None:
+            signal.signal(signum, self._onSignal)
+
+    def _onSignal(self, signum, frame):
+        if not self.running:
+            sys.exit(0)
+        self.requested = True
+        self.stop = True
+
+    def load(self):
+        """The saved search as a dict, None if there is none."""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('tag') != self.tag:
+            return None  # 别的算法、权重或者剪枝存的，h不一样
+        random.setstate(data['random'])
+        self.elapsed = data['elapsed']
+        self.resumes = data['resumes'] + 1
+        return data
+
+    def start(self):
+        self.running = True
+        self.startTime = time.time()
+        self.lastSave = self.startTime
+
+    def due(self):
+        return self.requested or time.time() - self.lastSave >= self.interval
+
+    def save(self, data):
+        data['tag'] = self.tag
+        data['elapsed'] = self.elapsed + time.time() - self.startTime
+        data['resumes'] = self.resumes
+        data['random'] = random.getstate()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+        self.lastSave = time.time()
+        self.requested = False
+        if self.stop:
+            sys.exit(0)
+
+    def finish(self):
+        self.running = False
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _saveAStar(problem, start, frontierMap, exploredSet):
+    # Nodes are numbered parents first, so on load a parent always comes before its children.
+    encode = problem.encodeState
+    ids = {}
+    records = []
+    parents = array.array('i')
+    gs = array.array('i')
+    hs = array.array('i')
+    actions = []
+    for node in frontierMap.values():
+        chain = []
+        while node is not None and id(node) not in ids:
+            chain.append(node)
+            node = node[1]
+        for n in reversed(chain):
+            ids[id(n)] = len(records)
+            records.append(encode(n[0]))
+            parents.append(ids[id(n[1])] if n[1] is not None else -1)
+            actions.append(n[2])
+            gs.append(n[3])
+            hs.append(n[4])
+    return {
+        'start': encode(start),
+        'nodes': b''.join(records),
+        'parents': parents.tobytes(),
+        'g': gs.tobytes(),
+        'h': hs.tobytes(),
+        'actions': actions,
+        'open': array.array('i', [ids[id(n)] for n in frontierMap.values()]).tobytes(),
+        'closed': b''.join([encode(state) for state in exploredSet]),
+    }
+
+
+def _loadAStar(problem, data, frontier, frontierMap, exploredSet):
+    decode = problem.decodeState
+    width = len(data['start'])
+    records = data['nodes']
+    parents, gs, hs, opens = [array.array('i', data[key]) for key in ('parents', 'g', 'h', 'open')]
+    actions = data['actions']
+    nodes = []
+    for i, p in enumerate(parents):
+        state = decode(records[i * width:(i + 1) * width])
+        nodes.append([state, nodes[p] if p >= 0 else None, actions[i], gs[i], hs[i]])
+    for i in opens:
+        node = nodes[i]
+        frontier.push(node, node[3] + node[4])
+        frontierMap[node[0]] = node
+    closed = data['closed']
+    for i in range(0, len(closed), width):
+        exploredSet.add(decode(closed[i:i + width]))
+
+
+def nodeHeuristic(node):
+    """The h value of an aStarSearch node, e.g. as the tiebreak of util.BucketPriorityQueue."""
+    return node[4]
+
+
+def aStarSearch(problem, heuristic=nullHeuristic, progress=nullProgress, frontier=None, checkpoint=None):
+    """
+      frontier: an empty priority queue with the util.PriorityQueue interface,
+      util.PriorityQueue() if None.
+      checkpoint: a Checkpointer. The search resumes from its file if that
+      was saved for the same start state (see SearchProblem.encodeState)
+      and the same checkpoint.tag, and saves the open nodes with their parent chains and the closed set
+      to it while running.
+    """
     if heuristic is None:
         heuristic = nullHeuristic
     if progress is None:
         progress = nullProgress
+    if frontier is None:
+        frontier = util.PriorityQueue()
 
-    frontier = util.PriorityQueue()
-    state = problem.getStartState()
-    g = 0
-    h = heuristic(state, problem)
-    f = g + h
-    node = [state, [], g, h]
-
-    frontier.push(node, f)
-    frontierMap = {state: node}
+    start = problem.getStartState()
+    frontierMap = {}
     exploredSet = set()
+    data = checkpoint.load() if checkpoint is not None else None
+    if data is not None and data['start'] == problem.encodeState(start):
+        _loadAStar(problem, data, frontier, frontierMap, exploredSet)
+    else:
+        h = heuristic(start, problem)
+        node = [start, None, None, 0, h]
+        frontier.push(node, h)
+        frontierMap[start] = node
+    if checkpoint is not None:
+        checkpoint.start()
 
     while True:
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save(_saveAStar(problem, start, frontierMap, exploredSet))
+
         if frontier.isEmpty():
+            if checkpoint is not None:
+                checkpoint.finish()
             return [], exploredSet
 
-        state, solution, curG, _ = frontier.pop()
+        curNode = frontier.pop()
+        state, curG = curNode[0], curNode[3]
         del frontierMap[state]
 
         if problem.isGoalState(state):
-            return solution, exploredSet
+            if checkpoint is not None:
+                checkpoint.finish()
+            return rebuildSolution(curNode), exploredSet
 
         exploredSet.add(state)
         progress(exploredSet, frontier)
@@ -117,11 +557,12 @@ def aStarSearch(problem, heuristic=nullHeuristic, progress=nullProgress):
 
             if node:
                 g = curG + stepCost
-                _, _, oldG, h = node
+                oldG, h = node[3], node[4]
                 if g < oldG:
                     f = g + h
-                    node[1] = [*solution, action]
-                    node[2] = g
+                    node[1] = curNode
+                    node[2] = action
+                    node[3] = g
                     frontier.update(node, f)
                 else:
                     pass  # ignore
@@ -129,11 +570,119 @@ def aStarSearch(problem, heuristic=nullHeuristic, progress=nullProgress):
                 g = curG + stepCost
                 h = heuristic(nextState, problem)
                 f = g + h
-                node = [nextState, [*solution, action], g, h]
+                node = [nextState, curNode, action, g, h]
                 frontier.push(node, f)
                 frontierMap[nextState] = node
 
 
+class ExploredCounter:
+    """Stands in for the explored set of engines that keep none, len() is the number of expanded states."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+
+class TranspositionTable:
+    """
+      A fixed size table of states for IDA*, a state goes to slot
+      hash(state) % size. A slot remembers the smallest g its state was
+      reached with in the current iteration. A new state replaces the slot's
+      state when the slot is from an older iteration or the new g is not
+      larger, so shallow entries, which cut the largest subtrees, survive.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.states = [None] * size
+        self.g = [0] * size
+        self.iteration = [-1] * size
+
+    def seen(self, state, g, iteration):
+        """True if state was already reached with g or less in this iteration, else record it."""
+        slot = hash(state) % self.size
+        old = self.states[slot]
+        current = self.iteration[slot] == iteration
+        if current and old == state:
+            if self.g[slot] <= g:
+                return True
+            self.g[slot] = g
+            return False
+        if old is None or not current or g <= self.g[slot]:
+            self.states[slot] = state
+            self.g[slot] = g
+            self.iteration[slot] = iteration
+        return False
+
+
+def iterativeDeepeningAStarSearch(problem, heuristic=nullHeuristic, progress=nullProgress, tableSize=1 << 20):
+    """
+      IDA*: depth first searches bounded by f, the bound raised to the
+      smallest f that exceeded it after every iteration. Only the current
+      path and a TranspositionTable of tableSize slots are kept, so memory
+      stays flat however long the search runs. Successors are tried in the
+      order of problem.orderSuccessors.
+    """
+    if heuristic is None:
+        heuristic = nullHeuristic
+    if progress is None:
+        progress = nullProgress
+
+    explored = ExploredCounter()
+    table = TranspositionTable(tableSize)
+    start = problem.getStartState()
+    if problem.isGoalState(start):
+        return [], explored
+
+    def children(state, parent):
+        successors = problem.orderSuccessors(state, problem.getSuccessors(state), parent)
+        # h right away, the heuristic may rely on state being the last one expanded
+        return [(nextState, action, stepCost, heuristic(nextState, problem))
+                for nextState, action, stepCost in successors]
+
+    bound = heuristic(start, problem)
+    iteration = 0
+    while True:
+        nextBound = float('inf')
+        table.seen(start, 0, iteration)
+        explored.count += 1
+        frames = [[start, 0, children(start, None), 0]]  # state, g, children, next child
+        actions = []
+        while frames:
+            frame = frames[-1]
+            state, g, nodes, i = frame
+            if i == len(nodes):
+                frames.pop()
+                if frames:
+                    actions.pop()
+                continue
+            frame[3] = i + 1
+
+            nextState, action, stepCost, h = nodes[i]
+            nextG = g + stepCost
+            f = nextG + h
+            if f > bound:
+                if f < nextBound:
+                    nextBound = f
+                continue
+            if table.seen(nextState, nextG, iteration):
+                continue
+            if problem.isGoalState(nextState):
+                return [*actions, action], explored
+
+            explored.count += 1
+            progress(explored, frames)
+            actions.append(action)
+            frames.append([nextState, nextG, children(nextState, state), 0])
+
+        if nextBound == float('inf'):
+            return [], explored
+        bound = nextBound
+        iteration += 1
+
+
 def uniformCostSearch(problem):
     """Search the node of least total cost first."""
     return aStarSearch(problem)
@@ -141,6 +690,8 @@ def uniformCostSearch(problem):
 
 # Abbreviations
 bfs = breadthFirstSearch
+lsbfs = levelSynchronousSearch
 dfs = depthFirstSearch
 astar = aStarSearch
+idastar = iterativeDeepeningAStarSearch
 ucs = uniformCostSearch
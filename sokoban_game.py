@@ -1,8 +1,13 @@
+import sys
+import signal
 import multiprocessing
 import pyglet
 import pyglet.window.key as key
 import solver
 import space
+import portfolio
+import tablestore
+import telemetry
 
 KEY_TO_ACTIONS = {
     key.LEFT: 'l',
@@ -170,6 +175,30 @@ class SokobanGame(object):
             self.solver_algorithm = solver.ASTAR_DEADLOCK
             self.stop_plan()
 
+        elif symbol == key._4:
+            self.solver_algorithm = solver.ASTAR_PUSH
+            self.stop_plan()
+
+        elif symbol == key._5:
+            self.solver_algorithm = solver.IDASTAR
+            self.stop_plan()
+
+        elif symbol == key._6:
+            self.solver_algorithm = solver.EXTERNAL_ASTAR
+            self.stop_plan()
+
+        elif symbol == key._7:
+            self.solver_algorithm = solver.BIDIRECTIONAL
+            self.stop_plan()
+
+        elif symbol == key._8:
+            self.solver_algorithm = portfolio.PORTFOLIO
+            self.stop_plan()
+
+        elif symbol == key._9:
+            self.solver_algorithm = solver.PARALLEL_ASTAR
+            self.stop_plan()
+
     def next_unsolved_level(self, dir):
         c = self.cur_level
         while True:
@@ -210,8 +239,7 @@ class SokobanGame(object):
                     action_list, explored = inf
                     action_str = "".join(action_list)
                     if self.state == self.start_state:
-                        self.solved[self.cur_level] = (action_str, explored)
-                        self.settings.set_solved(self.solved)
+                        self.solved.add(self.cur_level, action_str, explored, self.start_state.layout)
 
                     self.start_act(action_str, explored)
                     progress = None
@@ -230,7 +258,8 @@ class SokobanGame(object):
                 self.stop_plan()
 
     step_to_text = {STEP_NONE: '', STEP_THINK: 'think', STEP_ACT: 'act'}
-    algorithm_to_text = {solver.BFS: 'bfs', solver.ASTAR: 'astar', solver.ASTAR_DEADLOCK: 'astar_deadlock'}
+    algorithm_to_text = {algorithm: name for name, algorithm in solver.ALGORITHMS.items()}
+    algorithm_to_text[portfolio.PORTFOLIO] = 'portfolio'
 
     def update_label(self):
         if self.play_mode:
@@ -258,7 +287,10 @@ class SokobanGame(object):
             self.solver.end()
             self.solver = None
 
-        self.solver = ConcurrentSolver(self.state, self.solver_algorithm)
+        if self.solver_algorithm == portfolio.PORTFOLIO:
+            self.solver = portfolio.PortfolioSolver(self.state, log=print)
+        else:
+            self.solver = ConcurrentSolver(self.state, self.solver_algorithm)
         self.solver.start()
         self.step_state = STEP_THINK
         self.plan_explored = 0
@@ -299,9 +331,12 @@ class SokobanGame(object):
 class ConcurrentSolver:
     def __init__(self, startState, algorithm):
         self.startState = startState
-        self.queue = multiprocessing.Queue()
-        self.problem = solver.SokobanSearchProblem(startState, progress=self._progress, algorithm=algorithm)
+        self.queue = multiprocessing.Queue()  # 只发结果，进度走共享内存
+        self.telemetry = telemetry.Telemetry()
+        self.problem = solver.SokobanSearchProblem(startState, algorithm=algorithm, store=tablestore.TableStore())
+        self.problem.progress = self.telemetry.reporter(0, self.problem)
         self.process = multiprocessing.Process(target=self._solve)
+        self.explored = 0  # 上次poll报出去的展开数
 
     def start(self):
         self.process.start()
@@ -313,16 +348,19 @@ class ConcurrentSolver:
         try:
             return self.queue.get_nowait()
         except:
+            pass
+        sample = self.telemetry.read(0)
+        if sample.expanded == self.explored:
             return None
-
-    def _progress(self, exploredSet, frontier):
-        exploredSize, frontierSize = len(exploredSet), len(frontier)
-        if exploredSize % 100 == 0:
-            self.queue.put([0, (exploredSize, frontierSize)])
+        self.explored = sample.expanded
+        return [0, (sample.expanded, sample.frontier)]
 
     def _solve(self):
+        # terminate时抛SystemExit，并行A*在finally里结束它的子进程
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
         actions, exploredSet = self.problem.solve()
         exploredSize = len(exploredSet)
+        self.problem.progress.finish(exploredSize)
         self.queue.put([1, (actions, exploredSize)])
 
 
@@ -0,0 +1,200 @@
+import os
+import time
+import zlib
+import atexit
+import hashlib
+import collections.abc
+
+try:
+    import fcntl
+except ImportError:  # windows没有flock，只靠O_APPEND
+    fcntl = None
+
+SYNC_EVERY = 16  # 攒够这么多条记录fsync一次
+SYNC_INTERVAL = 5.0  # 或者离上次fsync过了这么多秒
+
+
+def start_key(layout):
+    """
+      Hash of a level's start position: walls, destinations, boxes and man.
+      Unlike tablestore.layout_key, which only hashes the walls and
+      destinations that the deadlock tables depend on, it includes the
+      boxes and the man, since a solution only replays from the exact start
+      it was found for. Levels with the same key share their solutions.
+    """
+    h = hashlib.sha1()
+    for line in layout:
+        h.update(bytes(line))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def _parse(line):
+    """(level, key, length, explored) of a record line, None if it is damaged."""
+    fields = line.rstrip(b'\n').split(b' ')
+    if len(fields) != 6:
+        return None
+    level, key, length, explored, crc, actions = fields
+    try:
+        if zlib.crc32(b' '.join([level, key, length, explored, actions])) != int(crc, 16):
+            return None
+        return int(level), key.decode(), int(length), int(explored)
+    except ValueError:
+        return None
+
+
+def _better(entry, old):
+    # entry: (offset, size, length, explored)，短的好，一样长时展开少的好
+    return old is None or (entry[2], entry[3]) < (old[2], old[3])
+
+
+class SolutionStore(collections.abc.Mapping):
+    """
+      Solutions in an append-only file, one line per solve:
+      'level key length explored crc actions'. Writers append under
+      O_APPEND and flock, so concurrent processes never lose a record, and
+      fsync once every sync_every records or sync_interval seconds; a torn
+      or damaged line fails its crc and is skipped.
+
+      Nothing is read until the first lookup. Then only the offsets of the
+      best (shortest, then least explored) record per level and per
+      start_key are indexed; actions are read when asked for. Records that
+      other processes appended are picked up on the next lookup.
+
+      A read-only mapping of level -> (actions, explored); add writes.
+    """
+
+    def __init__(self, path, sync_every=SYNC_EVERY, sync_interval=SYNC_INTERVAL):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.levels = None  # 关卡 -> (offset, size, length, explored)
+        self.keys = {}  # start_key -> (offset, size, length, explored)
+        self.scanned = 0  # 文件里已经建了索引的字节数
+        self.fd = None
+        self.unsynced = 0
+        self.syncTime = time.time()
+
+    def _refresh(self):
+        if self.levels is None:
+            self.levels = {}
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size <= self.scanned:
+            return
+        offset = self.scanned
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # 还没写完，下次再看
+                record = _parse(line)
+                if record is not None:
+                    level, key, length, explored = record
+                    entry = (offset, len(line), length, explored)
+                    if _better(entry, self.levels.get(level)):
+                        self.levels[level] = entry
+                    if key != '-' and _better(entry, self.keys.get(key)):
+                        self.keys[key] = entry
+                offset += len(line)
+        self.scanned = offset
+
+    def _read(self, entry):
+        offset, size, _, explored = entry
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            line = f.read(size)
+        return line.rstrip(b'\n').rsplit(b' ', 1)[1].decode(), explored
+
+    def __getitem__(self, level):
+        self._refresh()
+        return self._read(self.levels[level])
+
+    def __contains__(self, level):
+        self._refresh()
+        return level in self.levels
+
+    def __iter__(self):
+        self._refresh()
+        return iter(sorted(self.levels))
+
+    def __len__(self):
+        self._refresh()
+        return len(self.levels)
+
+    def find(self, layout):
+        """The best (actions, explored) of any level with this layout, or None."""
+        self._refresh()
+        entry = self.keys.get(start_key(layout))
+        return None if entry is None else self._read(entry)
+
+    def adopt(self, layouts):
+        """
+          The levels of layouts, (level, layout) pairs, that have no
+          solution. A level that has none but shares its start with a level
+          that does, for example after the level file was reordered, gets
+          that solution recorded and is not returned. The log is indexed
+          once for the whole batch.
+        """
+        self._refresh()
+        unsolved = []
+        for level, layout in layouts:
+            if level in self.levels:
+                continue
+            entry = self.keys.get(start_key(layout))
+            if entry is None:
+                unsolved.append(level)
+                continue
+            actions, explored = self._read(entry)
+            self.add(level, actions, explored, layout)
+        self.sync()
+        return unsolved
+
+    def add(self, level, actions, explored, layout=None):
+        """Append a solution of level; it replaces the stored one only if it is better."""
+        actions = "".join(actions)
+        key = start_key(layout) if layout is not None else '-'
+        fields = [str(level), key, str(len(actions)), str(explored), actions]
+        crc = zlib.crc32(" ".join(fields).encode())
+        record = " ".join(fields[:4] + ["{0:08x}".format(crc), actions]).encode() + b'\n'
+
+        fd = self._open()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            end = os.lseek(fd, 0, os.SEEK_END)
+            if end:
+                os.lseek(fd, end - 1, os.SEEK_SET)
+                if os.read(fd, 1) != b'\n':
+                    record = b'\n' + record  # 上一个写的进程没写完，另起一行
+            os.write(fd, record)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.time() - self.syncTime >= self.sync_interval:
+            self.sync()
+
+    def _open(self):
+        if self.fd is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            atexit.register(self.close)
+        return self.fd
+
+    def sync(self):
+        if self.fd is not None and self.unsynced:
+            os.fsync(self.fd)
+        self.unsynced = 0
+        self.syncTime = time.time()
+
+    def close(self):
+        if self.fd is not None:
+            self.sync()
+            os.close(self.fd)
+            self.fd = None
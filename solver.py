@@ -1,112 +1,216 @@
 import search
 import space
-import munkres
+import util
 import deadlock
+import board
+import assignment
+import pruning
+import external
+import bidirectional
+import parallel
+import phases
+import tablestore
 
 
 def manhattan_distance(bp, dp):
     return abs(bp[0] - dp[0]) + abs(bp[1] - dp[1])
 
 
-# 用匈牙利算法来算下最短分配距离
-def munkres_distance(boxes, dests, distance_func):
-    matrix = [[distance_func(bp, dp) for dp in dests] for bp in boxes]
-    m = munkres.Munkres()
-    indexes = m.compute(matrix)
-    return sum([matrix[row][column] for row, column in indexes])
-
-
 # 满足Admissibility, 寻出的路径是最短的
+# 箱子到目的地的分配距离由problem.assignment增量计算并缓存
 def sokobanHeuristic(state, problem):
-    boxes = []
-    dests = []
-
-    for y, line in enumerate(state.layout):
-        for x, c in enumerate(line):
-            if c == space.S_BOX:
-                boxes.append((x, y))
-            elif c in [space.S_DEST, space.S_MAN_AT_DEST]:
-                dests.append((x, y))
-
-    dest_dis = 0
-    if boxes:
-        dest_dis = munkres_distance(boxes, dests, distance_func=problem.distance_func)
+    entry = problem.assignment.lookup(state, problem.expanding)
+    dest_dis = entry.cost
 
+    # 推箱子层面的搜索代价是推的次数，人的位置只是区域的代表，不计入
     man_dis = 0
-    mp = state.man_pos
-    if boxes:
-        man_dis = min([manhattan_distance(bp, mp) for bp in boxes]) - 1
+    loose = entry.loose
+    if loose and not problem.push_mode:
+        mp = state.man_pos
+        man_dis = min([manhattan_distance(bp, mp) for bp in loose]) - 1
         if man_dis < 0:
             man_dis = 0
+    if problem.weight != 1:  # weight大于1时不再满足Admissibility，但搜得快
+        return int((dest_dis + man_dis) * problem.weight)
     return dest_dis + man_dis
 
 
 BFS = 1
 ASTAR = 2
 ASTAR_DEADLOCK = 3
+ASTAR_PUSH = 4  # 以推箱子为一步，人的位置归一化为可达区域
+IDASTAR = 5  # 内存只有置换表那么大
+EXTERNAL_ASTAR = 6  # 以推箱子为一步，open和closed放在磁盘上
+BIDIRECTIONAL = 7  # 从开始推，同时从目的地拉，相遇即可
+PARALLEL_ASTAR = 8  # 以推箱子为一步，按状态hash分给多个进程
+CHECKPOINTED = (ASTAR, ASTAR_DEADLOCK, ASTAR_PUSH)  # 能存盘续跑的算法
+ALGORITHMS = {  # 命令行里的名字 -> 算法常量
+    'bfs': BFS,
+    'astar': ASTAR,
+    'astar_deadlock': ASTAR_DEADLOCK,
+    'astar_push': ASTAR_PUSH,
+    'idastar': IDASTAR,
+    'external_astar': EXTERNAL_ASTAR,
+    'bidirectional': BIDIRECTIONAL,
+    'parallel_astar': PARALLEL_ASTAR,
+}
 
 
 class SokobanSearchProblem(search.SearchProblem):
 
-    def __init__(self, startState, progress=None, algorithm=ASTAR_DEADLOCK):
-        self.startState = startState
-        self.deadlock = deadlock.Deadlock(self.startState.layout)
+    def __init__(self, startState, progress=None, algorithm=ASTAR_DEADLOCK, bfs_max_bytes=None, store=None,
+                 detectors=pruning.DEFAULT_DETECTORS, table_size=1 << 20, spill_dir=None,
+                 ram_budget=external.DEFAULT_RAM_BUDGET, weight=1, workers=None, checkpoint=None,
+                 bfs_dup_layers=None):
+        # startState是space.SokobanState，搜索时只用紧凑的board.CompactState
+        self.board = board.SokobanBoard(startState.layout)
+        self.startState = self.board.compact(startState)
+        self.deadlock = deadlock.Deadlock(startState.layout)
         self.progress = progress
+        if algorithm == PARALLEL_ASTAR and not parallel.AVAILABLE:
+            algorithm = ASTAR_PUSH  # 没有fork时退回单进程的推箱子A*
         self.algorithm = algorithm
+        self.store = store
+        self.table_size = table_size  # IDA*置换表的大小
+        self.spill_dir = spill_dir  # 外存A*的临时文件目录，None用系统的临时目录
+        self.ram_budget = ram_budget  # 外存A*在内存里缓存的字节数
+        self.weight = weight  # sokobanHeuristic乘上的权重
+        self.workers = workers  # 并行A*的进程数，None为cpu个数
+        self.checkpoint = checkpoint  # search.Checkpointer，CHECKPOINTED的算法定时存盘，下次从存盘处继续
+        self.detectors = detectors
+        self.push_mode = algorithm in (ASTAR_PUSH, EXTERNAL_ASTAR, BIDIRECTIONAL, PARALLEL_ASTAR)
+        self.bfs_max_bytes = bfs_max_bytes  # BFS各层占用内存的上限，None不限
+        self.bfs_dup_layers = bfs_dup_layers  # BFS查重往回看几层，None全部
         self.distance_func = manhattan_distance
-        if algorithm == ASTAR_DEADLOCK:
-            self.deadlock.prepare()
+        self.pruner = None  # 只有带deadlock的算法才剪枝
+        if algorithm in (ASTAR_DEADLOCK, ASTAR_PUSH, IDASTAR, EXTERNAL_ASTAR, BIDIRECTIONAL, PARALLEL_ASTAR):
+            self.deadlock.prepare(store=store)  # store: tablestore.TableStore，表存盘复用
             self.distance_func = self.deadlock.get_distance
+            # 死锁检测都假定每个箱子要占一个目的地，箱子比目的地多时多的箱子停在哪都行，不能剪
+            if bin(self.startState.boxes).count('1') <= len(self.board.dest_cells):
+                self.pruner = pruning.Pruner(self, detectors)
+        self.assignment = assignment.AssignmentHeuristic(self.board, self.distance_func, deadlock.UNREACHABLE)
+        self.expanding = None  # 正在展开的状态，sokobanHeuristic用它增量修正分配
+        self.generated = 0  # 生成的后继数，包括被剪掉的，telemetry.Reporter读它
+        self.heuristic = sokobanHeuristic
+        # 环境变量SOKOBAN_PROFILE打开时统计各阶段的时间，关着时是None
+        self.profiler = phases.from_env(
+            lambda: '{0}_{1}'.format(algorithm, tablestore.layout_key(startState.layout)[:8]))
+        if self.push_mode:
+            self.pushStartState = self.board.normalize(self.startState.boxes, self.startState.man)
+
+    def checkpoint_tag(self):
+        """What a saved search depends on besides the start state: the algorithm, weight and detectors."""
+        detectors = [d if isinstance(d, str) else d.name for d in self.detectors] if self.pruner else []
+        return "alg{0}_w{1}_{2}".format(self.algorithm, self.weight, "-".join(detectors) or 'none')
 
     def getStartState(self):
+        if self.push_mode:
+            return self.pushStartState
         return self.startState
 
     def isGoalState(self, state):
         return state.is_finished()
 
+    def encodeState(self, state):
+        return self.board.encode(state)
+
+    def decodeState(self, data):
+        return self.board.decode(data)
+
     def solve(self):
+        if self.profiler is None:
+            return self._solve()
+        self._profile()
+        self.profiler.start()
+        try:
+            return self._solve()
+        finally:
+            self.profiler.stop()
+            print(self.profiler.report())
+            path = self.profiler.save()
+            if path:
+                print("flame graph samples: {0}".format(path))
+
+    def _profile(self):
+        profiler = self.profiler
+        profiler.patch(self, 'getSuccessors', 'successors')
+        profiler.patch(self, 'heuristic', 'heuristic')
+        if self.pruner:
+            profiler.patch(self.pruner, 'is_deadlock', 'deadlock')
+        profiler.patch(board.CompactState, '__hash__', 'hashing')
+        profiler.patch(board.CompactState, '__eq__', 'hashing')
+
+    def _solve(self):
         if self.algorithm == BFS:
-            return search.bfs(self, progress=self.progress)
+            return search.lsbfs(self, progress=self.progress, maxBytes=self.bfs_max_bytes,
+                                dupLayers=self.bfs_dup_layers)
+        elif self.algorithm == IDASTAR:
+            return search.idastar(self, heuristic=self.heuristic, progress=self.progress, tableSize=self.table_size)
+        elif self.push_mode:
+            if self.algorithm == EXTERNAL_ASTAR:
+                pushes, exploredSet = external.externalAStarSearch(
+                    self, heuristic=self.heuristic, progress=self.progress,
+                    spillDir=self.spill_dir, ramBudget=self.ram_budget)
+            elif self.algorithm == BIDIRECTIONAL:
+                pushes, exploredSet = bidirectional.bidirectionalSearch(
+                    self, heuristic=self.heuristic, progress=self.progress)
+            elif self.algorithm == PARALLEL_ASTAR:
+                pushes, exploredSet = parallel.parallelAStarSearch(
+                    self, heuristic=self.heuristic, progress=self.progress, workers=self.workers)
+            else:
+                pushes, exploredSet = self._astar()
+            actions = self.board.expand_pushes(self.startState.boxes, self.startState.man, pushes)
+            return actions, exploredSet
         else:
-            return search.astar(self, heuristic=sokobanHeuristic, progress=self.progress)
+            return self._astar()
+
+    def _astar(self):
+        # f都是小整数，用桶队列，f相同时h小的优先
+        frontier = util.BucketPriorityQueue(tiebreak=search.nodeHeuristic)
+        if self.profiler:
+            for method in ('push', 'pop', 'update'):
+                self.profiler.patch(frontier, method, 'queue')
+        return search.astar(self, heuristic=self.heuristic, progress=self.progress, frontier=frontier,
+                            checkpoint=self.checkpoint)
 
     def getSuccessors(self, state):
+        self.expanding = state
+        if self.push_mode:
+            pushes = self.board.pushes(state)
+            self.generated += len(pushes)
+            return [(nxt, push, 1) for nxt, push, new_box_pos in pushes
+                    if not (self.pruner and self.is_deadlock(nxt, new_box_pos))]
+
         successors = []
 
         for action, (dx, dy) in space.ACTIONS.items():
             nxt, new_box_pos = state.try_move2(dx, dy)
             if nxt:
-                if self.algorithm == ASTAR_DEADLOCK and new_box_pos:
+                self.generated += 1
+                if self.pruner and new_box_pos:
                     if self.is_deadlock(nxt, new_box_pos):
                         continue
                 successors.append((nxt, action, 1))
 
         return successors
 
+    def orderSuccessors(self, state, successors, parent=None):
+        # 先试继续推刚推过的那个箱子
+        if parent is None:
+            return successors
+        last_box = state.boxes & ~parent.boxes
+        if not last_box:
+            return successors
+        first = []
+        rest = []
+        for successor in successors:
+            if successor[0].boxes & last_box != last_box:
+                first.append(successor)
+            else:
+                rest.append(successor)
+        return first + rest
+
     def is_deadlock(self, state, new_box_pos):
-        area = self.deadlock.get_area(new_box_pos)
-        if area.reachable_dest_count == 0:
-            return True
-
-        max_box_cnt = area.reachable_dest_count
-        cnt = 0
-        for area_pos in area.positions:
-            if state.has_box(area_pos[0], area_pos[1]):
-                cnt += 1
-        if cnt > max_box_cnt:
-            return True
-
-        # 这是4个一组，如果都被挡住则不能再移动了，又有非目的地的箱子则失败
-        bx, by = new_box_pos
-        layout = state.layout
-        diagonals = [(-1, -1), (1, 1), (-1, 1), (1, -1)]
-        quads = [[(bx, by), (bx + dx, by), (bx + dx, by + dy), (bx, by + dy)] for dx, dy in diagonals]
-        for q in quads:
-            ss = [layout[y][x] for x, y in q]
-            # 不用考虑S_OUTSIDE,因为这种情况会被deadlock先干掉
-            all_block_or_box = all([s in [space.S_WALL, space.S_BOX, space.S_BOX_AT_DEST] for s in ss])
-            all_block_or_boxAtDst = all([s in [space.S_WALL, space.S_BOX_AT_DEST] for s in ss])
-            if all_block_or_box and not all_block_or_boxAtDst:
-                return True
-
-        return False
+        x, y = new_box_pos
+        return self.pruner.is_deadlock(state, self.board.cell_id(x, y))
@@ -1,6 +1,8 @@
 import os
+import random
 import configparser
-import pyglet
+
+import solutions
 
 S_WALL = 0
 S_SPACE = 1
@@ -28,63 +30,26 @@ def is_static_block(c):
 
 
 class SokobanLoader(object):
+    # pyglet只有画图时才需要，求解器不用装
 
     def __init__(self):
+        import pyglet
         pyglet.resource.path = ['res']
         pyglet.resource.reindex()
 
     def load_maps(self):
-        sign_to_index = {'+': S_WALL,
-                         ' ': S_SPACE,
-                         '-': S_OUTSIZE,
-                         '#': S_BOX,
-                         '@': S_BOX_AT_DEST,
-                         '.': S_DEST,
-                         '^': S_MAN,
-                         '$': S_MAN_AT_DEST}
-
-        maps = []
-        current_map = []
-        MBegin = False
-        with pyglet.resource.file('map.txt', 'r') as sf:
-            for line in sf.readlines():
-                if not MBegin and line.startswith("M"):
-                    MBegin = True
-                    continue
-                if not MBegin:
-                    continue
-
-                if line.startswith("M") and current_map:
-                    maps.append(current_map)
-                    current_map = []
-                elif len(line) > 0 and line[0] in sign_to_index:
-                    current_map.insert(0, [sign_to_index[s] for s in line.strip()])
-
-        maps.append(current_map)
-
-        states = []
-        for map in maps:
-            man = None
-            for y, line in enumerate(map):
-                for x, idx in enumerate(line):
-                    if idx == S_MAN or idx == S_MAN_AT_DEST:
-                        if man:
-                            raise Exception("multiple man")
-                        else:
-                            man = (x, y)
-            if man:
-                states.append(SokobanState(map, man))
-            else:
-                raise Exception("man not found")
-        return states
+        import levels
+        return list(levels.LevelCollection())
 
     def load_tiles(self):
+        import pyglet
         tile = pyglet.resource.image("tile.png")
         tile_seq = pyglet.image.ImageGrid(tile, 1, 8)
         tiles = pyglet.image.TextureGrid(tile_seq)
         return tiles
 
     def load_tiles_sep(self):
+        import pyglet
         ar =  [ pyglet.resource.image(fn) for fn in ["0_wall.png",
                                                       "1_floor.png",
                                                       "2_outside.png",
@@ -99,9 +64,20 @@ class SokobanLoader(object):
             a.height = 64
         return ar
 
+
+def settings_path(name):
+    """pyglet's settings directory for name, or the XDG one when pyglet is not installed."""
+    try:
+        import pyglet
+    except ImportError:
+        base = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+        return os.path.join(base, name)
+    return pyglet.resource.get_settings_path(name)
+
+
 class SokobanSettings(object):
     def __init__(self):
-        dir = pyglet.resource.get_settings_path('sokoban')
+        dir = settings_path('sokoban')
         if not os.path.exists(dir):
             os.makedirs(dir)
 
@@ -110,8 +86,15 @@ class SokobanSettings(object):
         if os.path.exists(self.setting_fn):
             with open(self.setting_fn, 'r') as f:
                 self.config.read_file(f)
-        self.solved = {int(sec): (self.config[sec]['actions'], int(self.config[sec]['explored']))
-                       for sec in self.config.sections()}
+        # 关卡 -> (actions, explored)，用solved.add保存新的解
+        self.solved = solutions.SolutionStore(os.path.join(dir, 'solutions.log'))
+        if self.config.sections():
+            # 以前的版本每关一个section存在settings.ini里，搬过去
+            for sec in self.config.sections():
+                self.solved.add(int(sec), self.config[sec]['actions'], int(self.config[sec]['explored']))
+                del self.config[sec]
+            self.solved.sync()
+            self.save()
 
     def get(self, option, fallback=''):
         return self.config.get('DEFAULT', option, fallback=fallback)
@@ -123,36 +106,46 @@ class SokobanSettings(object):
         self.config.set('DEFAULT', option, str(value))
         self.save()
 
-    def set_solved(self, solution):
-        self.solved = solution
-        for sec in self.config.sections():
-            del self.config[sec]
-        keys = list(solution.keys())
-        keys.sort()  # 排序后再保存
-        for key in keys:
-            actions, explored = solution[key]
-            self.config[str(key)] = {
-                'explored': str(explored),
-                'actions': actions
-            }
-
-        self.save()
-
     def save(self):
         with open(self.setting_fn, 'w') as f:
             self.config.write(f)
 
 
+class ZobristTable(object):
+    """
+      Zobrist keys of a level: one random 64 bit number for a box and one for
+      the man on every cell. The seed is fixed, so the same layout always gets
+      the same keys, also in other processes.
+    """
+
+    def __init__(self, layout, seed=0):
+        rnd = random.Random(seed)
+        self.box = [[rnd.getrandbits(64) for _ in line] for line in layout]
+        self.man = [[rnd.getrandbits(64) for _ in line] for line in layout]
+
+    def hash_of(self, layout, man_pos):
+        h = 0
+        for y, line in enumerate(layout):
+            for x, s in enumerate(line):
+                if s == S_BOX or s == S_BOX_AT_DEST:
+                    h ^= self.box[y][x]
+        x, y = man_pos
+        return h ^ self.man[y][x]
+
+
 class SokobanState(object):
-    def __init__(self, layout, man_pos):
+    def __init__(self, layout, man_pos, zobrist=None, zhash=None):
         self.layout = [list(line) for line in layout]  # deep copy
         self.man_pos = man_pos
+        # 每关只建一次zobrist表，copy时共享，zhash在移动时增量更新
+        self.zobrist = zobrist or ZobristTable(self.layout)
+        self.zhash = self.zobrist.hash_of(self.layout, man_pos) if zhash is None else zhash
 
     def __eq__(self, other):
-        return other and self.man_pos == other.man_pos and self.layout == other.layout
+        return other and self.zhash == other.zhash and self.man_pos == other.man_pos and self.layout == other.layout
 
     def __hash__(self):
-        return hash((tuple([tuple(line) for line in self.layout]), self.man_pos))
+        return self.zhash
 
     def has_space(self, x, y):
         s = self.layout[y][x]
@@ -164,7 +157,11 @@ class SokobanState(object):
 
     def enter_man(self, x, y):
         self.man_pos = (x, y)
-        if is_dest(self.layout[y][x]):
+        s = self.layout[y][x]
+        if s == S_BOX or s == S_BOX_AT_DEST:
+            self.zhash ^= self.zobrist.box[y][x]
+        self.zhash ^= self.zobrist.man[y][x]
+        if is_dest(s):
             self.layout[y][x] = S_MAN_AT_DEST
         else:
             self.layout[y][x] = S_MAN
@@ -172,17 +169,20 @@ class SokobanState(object):
     def leave_man(self, x, y):
         if self.layout[y][x] == S_MAN:
             self.layout[y][x] = S_SPACE
+            self.zhash ^= self.zobrist.man[y][x]
         elif self.layout[y][x] == S_MAN_AT_DEST:
             self.layout[y][x] = S_DEST
+            self.zhash ^= self.zobrist.man[y][x]
 
     def enter_box(self, x, y):
+        self.zhash ^= self.zobrist.box[y][x]
         if is_dest(self.layout[y][x]):
             self.layout[y][x] = S_BOX_AT_DEST
         else:
             self.layout[y][x] = S_BOX
 
     def copy(self):
-        return SokobanState(self.layout, self.man_pos)
+        return SokobanState(self.layout, self.man_pos, self.zobrist, self.zhash)
 
     def try_move(self, dx, dy):
         nxt, _ = self.try_move2(dx, dy)
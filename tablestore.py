@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+
+import space
+import levels
+import deadlock
+
+try:
+    import numpy
+except ImportError:  # 没有numpy时不存盘，每次重新计算
+    numpy = None
+
+DEFAULT_DIR = os.environ.get('SOKOBAN_TABLES', 'tables')
+
+
+def layout_key(layout):
+    """静态部分(墙和目的地)的hash，箱子和人的位置不影响"""
+    h = hashlib.sha1()
+    for line in layout:
+        h.update(''.join(['#' if space.is_static_block(c) else '.' if space.is_dest(c) else ' '
+                          for c in line]).encode())
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+class TableStore(object):
+    """
+      On-disk store of the tables Deadlock.prepare builds, one directory of
+      .npy files per static layout. The files are opened read-only through
+      mmap, so repeated runs and parallel workers share the same pages.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or DEFAULT_DIR
+
+    def path(self, layout):
+        return os.path.join(self.directory, layout_key(layout))
+
+    def patterns_path(self, layout):
+        """patterns.PatternDatabase的死锁pattern，一行一个16进制的箱子bitmask"""
+        return self.path(layout) + '.patterns'
+
+    def contains(self, layout):
+        return numpy is not None and os.path.exists(os.path.join(self.path(layout), 'distance.npy'))
+
+    def load(self, dl):
+        """把表读进deadlock.Deadlock，dl的spaceid要先准备好"""
+        path = self.path(dl.layout)
+
+        def npy(name):
+            return numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        distance = npy('distance')
+        if distance.shape != (dl.space_cnt, dl.space_cnt):
+            raise Exception("table {0} does not match the layout".format(path))
+        dl.distance_matrix = distance
+
+        packed = numpy.packbits(npy('reach_dest'), axis=1, bitorder='little')
+        dl.spaceid_to_dest_mask = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+
+        areas = []
+        members = npy('area_members')
+        for a, dest_count in enumerate(npy('area_dest_count').tolist()):
+            area = deadlock.Area(dest_count)
+            area.positions = [dl.spaceid_to_pos[i] for i in numpy.nonzero(members[a])[0]]
+            areas.append(area)
+        dl.spaceid_to_area = [areas[a] if a >= 0 else deadlock.DEADLOCK_AREA for a in npy('area_of').tolist()]
+
+        dl.dead_mask = 0
+        for spaceid in numpy.nonzero(npy('dead'))[0]:
+            dl.dead_mask |= 1 << int(spaceid)
+
+    def save(self, dl):
+        if numpy is None:
+            return
+        n = dl.space_cnt
+        areas = []
+        area_index = {}
+        area_of = numpy.full(n, -1, dtype=numpy.int32)
+        for spaceid, area in enumerate(dl.spaceid_to_area):
+            if area is deadlock.DEADLOCK_AREA:
+                continue
+            if id(area) not in area_index:
+                area_index[id(area)] = len(areas)
+                areas.append(area)
+            area_of[spaceid] = area_index[id(area)]
+
+        members = numpy.zeros((len(areas), n), dtype=bool)
+        for a, area in enumerate(areas):
+            for pos in area.positions:
+                members[a, dl._id(pos)] = True
+
+        tables = {
+            'distance': numpy.asarray(dl.distance_matrix, dtype=numpy.int32),
+            'reach_dest': numpy.array([[(mask >> i) & 1 for i in range(len(dl.dest_ids))]
+                                       for mask in dl.spaceid_to_dest_mask], dtype=bool).reshape(n, len(dl.dest_ids)),
+            'area_dest_count': numpy.array([area.reachable_dest_count for area in areas], dtype=numpy.int32),
+            'area_members': members,
+            'area_of': area_of,
+            'dead': numpy.array([(dl.dead_mask >> i) & 1 for i in range(n)], dtype=bool),
+        }
+
+        # 先写到临时目录再改名，别的进程不会读到写了一半的表
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.directory)
+        for name, table in tables.items():
+            numpy.save(os.path.join(tmp, name + '.npy'), table)
+        try:
+            os.rename(tmp, self.path(dl.layout))
+        except OSError:  # 别的进程已经存好了
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    store = TableStore(sys.argv[1] if len(sys.argv) > 1 else None)
+    layouts = levels.LevelCollection()
+    start = time.time()
+    for lvl, startState in enumerate(layouts):
+        dl = deadlock.Deadlock(startState.layout)
+        dl.prepare(store=store)
+        print("lvl={0} cells={1} {2}".format(
+            lvl, dl.space_cnt, " ".join(["{0}={1:.3f}s".format(k, v) for k, v in dl.timings.items()])))
+    print("共{0}关卡，耗时{1:.1f}秒，存在{2}".format(len(layouts), time.time() - start, store.directory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import os
+import time
+import collections
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # windows没有resource
+    resource = None
+
+FIELDS = ('active', 'expanded', 'generated', 'pruned', 'frontier', 'rss', 'rate', 'elapsed')
+PUBLISH_EVERY = 256  # 每展开这么多个状态才写一次共享内存
+RATE_INTERVAL = 1.0  # nodes/sec和内存每隔这么多秒更新一次
+READ_RETRIES = 4  # 读到写了一半的slot时重试几次，都不行就返回上次读到的
+_STRIDE = len(FIELDS) + 1  # 每个slot前面是版本号
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+Sample = collections.namedtuple('Sample', FIELDS)
+EMPTY = Sample(0, 0, 0, 0, 0, 0, 0.0, 0.0)
+
+
+def rss():
+    """Resident set size of this process in bytes; the peak where /proc is missing, 0 if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Telemetry(object):
+    """
+      Progress counters of solver processes in shared memory, one slot of
+      FIELDS per process. A writer bumps the slot's version to odd, writes
+      the fields and bumps it to even again; a reader retries when it sees
+      an odd or changed version. Neither side takes a lock or blocks, so
+      the coordinator can poll as often as it likes and the solver only
+      pays for a few stores now and then (see Reporter).
+
+      Create it before starting the processes so they inherit the memory.
+    """
+
+    def __init__(self, slots=1, ctx=None):
+        ctx = ctx or multiprocessing
+        self.slots = slots
+        self.raw = ctx.RawArray('d', slots * _STRIDE)
+        self.last = [EMPTY] * slots  # 每个slot最后一次读到的完整数据
+
+    def write(self, slot, values):
+        raw = self.raw
+        base = slot * _STRIDE
+        version = raw[base]
+        version += version % 2  # 上一个写的进程写到一半被kill了
+        raw[base] = version + 1  # 奇数表示正在写
+        raw[base + 1:base + _STRIDE] = list(values)
+        raw[base] = version + 2
+
+    def read(self, slot):
+        """The latest Sample of slot, never waits."""
+        raw = self.raw
+        base = slot * _STRIDE
+        for _ in range(READ_RETRIES):
+            version = raw[base]
+            if version % 2:
+                continue
+            values = raw[base + 1:base + _STRIDE]
+            if raw[base] == version:
+                self.last[slot] = Sample(*([int(v) for v in values[:-2]] + values[-2:]))
+                break
+        return self.last[slot]
+
+    def samples(self):
+        return [self.read(slot) for slot in range(self.slots)]
+
+    def clear(self, slot):
+        self.write(slot, EMPTY)
+
+    def reporter(self, slot, problem=None, every=PUBLISH_EVERY):
+        return Reporter(self, slot, problem, every)
+
+
+class Reporter(object):
+    """
+      A progress callback for the functions in search that publishes to one
+      slot of a Telemetry once every `every` expansions. Generated and pruned
+      states come from problem.generated and problem.pruner when a problem
+      is given; the rate and RSS are refreshed every RATE_INTERVAL seconds.
+    """
+
+    def __init__(self, telemetry, slot, problem=None, every=PUBLISH_EVERY):
+        self.telemetry = telemetry
+        self.slot = slot
+        self.problem = problem
+        self.every = every
+        self.expanded = 0  # 最后一次写出去的展开数
+        self.startTime = None
+        self.rateTime = None
+        self.rateExpanded = 0
+        self.rate = 0.0
+        self.rss = 0
+
+    def __call__(self, exploredSet, frontier):
+        if len(exploredSet) - self.expanded < self.every and self.startTime is not None:
+            return
+        self.publish(len(exploredSet), len(frontier))
+
+    def publish(self, expanded, frontier, active=1):
+        now = time.time()
+        if self.startTime is None:
+            self.startTime = self.rateTime = now
+            self.rss = rss()
+            self.rateExpanded = expanded
+        elif now - self.rateTime >= RATE_INTERVAL:
+            self.rate = (expanded - self.rateExpanded) / (now - self.rateTime)
+            self.rateTime = now
+            self.rateExpanded = expanded
+            self.rss = rss()
+        elif self.rateTime == self.startTime and now > self.startTime:
+            self.rate = (expanded - self.rateExpanded) / (now - self.startTime)  # 第一秒内先用平均值
+
+        generated = pruned = 0
+        problem = self.problem
+        if problem is not None:
+            generated = getattr(problem, 'generated', 0)
+            if getattr(problem, 'pruner', None):
+                pruned = sum([d.pruned for d in problem.pruner.detectors])
+
+        self.expanded = expanded
+        self.telemetry.write(self.slot, (active, expanded, generated, pruned, frontier, self.rss, self.rate,
+                                         now - self.startTime))
+
+    def finish(self, expanded=None):
+        """Publish the final counters and mark the slot inactive."""
+        self.publish(self.expanded if expanded is None else expanded, 0, active=0)
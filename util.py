@@ -1,4 +1,5 @@
 import heapq
+import collections
 
 
 class Stack:
@@ -27,11 +28,11 @@ class Queue:
     "A container with a first-in-first-out (FIFO) queuing policy."
 
     def __init__(self):
-        self.list = []
+        self.list = collections.deque()
 
     def push(self, item):
         "Enqueue the 'item' into the queue"
-        self.list.insert(0, item)
+        self.list.appendleft(item)
 
     def pop(self):
         """
@@ -88,4 +89,156 @@ class PriorityQueue:
             self.push(item, priority)
 
     def __len__(self):
-        return len(self.heap)
\ No newline at end of file
+        return len(self.heap)
+
+
+class IndexedPriorityQueue:
+    """
+      A binary heap that remembers the position of every item, so update
+      (decrease-key) is O(log n) instead of a linear scan and a heapify.
+      Items are looked up by identity. Works for any comparable priority.
+    """
+
+    def __init__(self):
+        self.heap = []  # [priority, count, item]
+        self.index = {}  # id(item) -> position in self.heap
+        self.count = 0
+
+    def push(self, item, priority):
+        entry = [priority, self.count, item]
+        self.count += 1
+        self.heap.append(entry)
+        self.index[id(item)] = len(self.heap) - 1
+        self._siftUp(len(self.heap) - 1)
+
+    def pop(self):
+        heap = self.heap
+        last = heap.pop()
+        if heap:
+            top = heap[0]
+            heap[0] = last
+            self.index[id(last[2])] = 0
+            self._siftDown(0)
+        else:
+            top = last
+        del self.index[id(top[2])]
+        return top[2]
+
+    def isEmpty(self):
+        return len(self.heap) == 0
+
+    def update(self, item, priority):
+        # Same contract as PriorityQueue.update, but the item is found through the index.
+        pos = self.index.get(id(item))
+        if pos is None:
+            self.push(item, priority)
+            return
+        entry = self.heap[pos]
+        if entry[0] <= priority:
+            return
+        entry[0] = priority
+        self._siftUp(pos)
+
+    def _siftUp(self, pos):
+        heap = self.heap
+        index = self.index
+        entry = heap[pos]
+        while pos > 0:
+            parentPos = (pos - 1) >> 1
+            parent = heap[parentPos]
+            if entry < parent:
+                heap[pos] = parent
+                index[id(parent[2])] = pos
+                pos = parentPos
+            else:
+                break
+        heap[pos] = entry
+        index[id(entry[2])] = pos
+
+    def _siftDown(self, pos):
+        heap = self.heap
+        index = self.index
+        size = len(heap)
+        entry = heap[pos]
+        while True:
+            childPos = 2 * pos + 1
+            if childPos >= size:
+                break
+            rightPos = childPos + 1
+            if rightPos < size and heap[rightPos] < heap[childPos]:
+                childPos = rightPos
+            child = heap[childPos]
+            if child < entry:
+                heap[pos] = child
+                index[id(child[2])] = pos
+                pos = childPos
+            else:
+                break
+        heap[pos] = entry
+        index[id(entry[2])] = pos
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class BucketPriorityQueue:
+    """
+      A priority queue for small integer priorities such as the f values of
+      Sokoban. Every priority has its own bucket. Inside a bucket items are
+      ordered by tiebreak(item), lowest first (the h value for A*), and then
+      last-in-first-out. update is O(1): the old entry is only marked dead and
+      skipped when it comes up.
+    """
+
+    def __init__(self, tiebreak=None):
+        self.buckets = {}  # priority -> {tie -> [entry]}
+        self.entries = {}  # id(item) -> live entry [priority, tie, item, alive]
+        self.tiebreak = tiebreak
+        self.minPriority = None
+
+    def push(self, item, priority):
+        tie = self.tiebreak(item) if self.tiebreak else 0
+        entry = [priority, tie, item, True]
+        self.entries[id(item)] = entry
+        bucket = self.buckets.get(priority)
+        if bucket is None:
+            bucket = self.buckets[priority] = {}
+            if self.minPriority is None or priority < self.minPriority:
+                self.minPriority = priority
+        ties = bucket.get(tie)
+        if ties is None:
+            bucket[tie] = [entry]
+        else:
+            ties.append(entry)
+
+    def pop(self):
+        if not self.entries:
+            raise IndexError('pop from empty priority queue')  # 和heapq一样，桶里可能只剩死掉的entry
+        while True:
+            bucket = self.buckets[self.minPriority]
+            tie = min(bucket)
+            ties = bucket[tie]
+            entry = ties.pop()
+            if not ties:
+                del bucket[tie]
+                if not bucket:
+                    del self.buckets[self.minPriority]
+                    self.minPriority = min(self.buckets) if self.buckets else None
+            if entry[3]:
+                del self.entries[id(entry[2])]
+                return entry[2]
+
+    def isEmpty(self):
+        return len(self.entries) == 0
+
+    def update(self, item, priority):
+        # Same contract as PriorityQueue.update.
+        entry = self.entries.get(id(item))
+        if entry is not None:
+            if entry[0] <= priority:
+                return
+            entry[3] = False
+        self.push(item, priority)
+
+    def __len__(self):
+        return len(self.entries)